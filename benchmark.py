@@ -0,0 +1,34 @@
+import argparse
+import time
+import generate
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare the parse time of the available XML parser backends.')
+    parser.add_argument('--input', type=str, default=generate.INPUT_FILE, help='Eldamo XML file to parse')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of runs per backend, the fastest one is reported')
+
+    return parser.parse_args()
+
+def time_backend(filename, backend, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        words, _ = generate.read_endamo_data(filename, backend)
+        times.append(time.perf_counter() - start)
+    return min(times), len(words)
+
+def main(args):
+    if args.input == generate.INPUT_FILE:
+        generate.ensure_endamo_data(argparse.Namespace(check_for_updates=False))
+    for backend in generate.PARSER_BACKENDS[1:]:
+        try:
+            generate.get_parser_backend(backend)
+        except ValueError as error:
+            print(f"{backend}: skipped, {error}")
+            continue
+        duration, number_of_words = time_backend(args.input, backend, args.repeats)
+        print(f"{backend}: {duration:.3f}s for {number_of_words} words")
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
@@ -0,0 +1,204 @@
+import argparse
+import contextlib
+import os
+import sqlite3
+import time
+import generate
+import make_update_instructions
+
+HISTORY_FILE = "input/card-history.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    deck TEXT NOT NULL,
+    created_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cards (
+    id INTEGER PRIMARY KEY,
+    deck TEXT NOT NULL,
+    guid TEXT,
+    front TEXT NOT NULL,
+    back TEXT NOT NULL,
+    first_seen_run INTEGER NOT NULL REFERENCES runs (id),
+    last_changed_run INTEGER NOT NULL REFERENCES runs (id),
+    removed_run INTEGER REFERENCES runs (id)
+);
+CREATE INDEX IF NOT EXISTS cards_current ON cards (deck, removed_run);
+CREATE INDEX IF NOT EXISTS cards_changes ON cards (deck, last_changed_run);
+CREATE TABLE IF NOT EXISTS card_sources (
+    card_id INTEGER NOT NULL REFERENCES cards (id),
+    l TEXT,
+    v TEXT
+);
+CREATE INDEX IF NOT EXISTS card_sources_card ON card_sources (card_id);
+CREATE INDEX IF NOT EXISTS card_sources_word ON card_sources (v, l);
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Query and maintain the card history that generate.py --card-history records.')
+    parser.add_argument('--history', type=str, default=HISTORY_FILE, help='Card history database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import-anki-export', help='Attach the GUIDs of an Anki export to the current cards of a deck')
+    import_parser.add_argument('deck', type=str, help='Name of the deck, e.g. Neo-Quenya')
+    import_parser.add_argument('anki_export', type=str, help='Anki export including the unique identifiers')
+
+    changes_parser = subparsers.add_parser('changes', help='List the cards of a deck that changed after a run')
+    changes_parser.add_argument('deck', type=str, help='Name of the deck, e.g. Neo-Quenya')
+    changes_parser.add_argument('--since-run', type=int, default=0, help='Last run of the previous release')
+
+    return parser.parse_args()
+
+def connect(history_file):
+    dir_name = os.path.dirname(history_file)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+    connection = sqlite3.connect(history_file)
+    connection.executescript(SCHEMA)
+    return connection
+
+def word_map_to_card(word_map):
+    front, back = generate.format_word(word_map).rstrip("\n").split(generate.DELIMITER)
+    sources = frozenset(tuple(source) for source in word_map.get("sources", []))
+    return front, back, sources
+
+def match_cards(current_cards, new_cards):
+    """
+    Pairs the current cards {id: (front, back, sources)} of a deck with the newly generated ones (front, back, sources).
+    Like update_update_file.py, a card keeps its identity if its front or its back stays the same.
+    Failing that, it keeps its identity if it was generated from one of the same words.
+    Returns the unchanged and changed (id, new card) pairs, the added cards and the ids of the removed cards.
+    """
+    unmatched_ids = set(current_cards)
+    unmatched_cards = list(range(len(new_cards)))
+    unchanged = []
+    changed = []
+    keys = [
+        lambda card: (card[0], card[1]),
+        lambda card: card[0],
+        lambda card: card[1],
+    ]
+    for key in keys:
+        ids_by_key = {}
+        for card_id in sorted(unmatched_ids):
+            ids_by_key.setdefault(key(current_cards[card_id]), []).append(card_id)
+        still_unmatched = []
+        for index in unmatched_cards:
+            candidates = ids_by_key.get(key(new_cards[index]), [])
+            if candidates:
+                card_id = candidates.pop(0)
+                unmatched_ids.remove(card_id)
+                if current_cards[card_id][:2] == new_cards[index][:2]:
+                    unchanged.append((card_id, new_cards[index]))
+                else:
+                    changed.append((card_id, new_cards[index]))
+            else:
+                still_unmatched.append(index)
+        unmatched_cards = still_unmatched
+
+    ids_by_source = {}
+    for card_id in sorted(unmatched_ids):
+        for source in current_cards[card_id][2]:
+            ids_by_source.setdefault(source, []).append(card_id)
+    added = []
+    for index in unmatched_cards:
+        card = new_cards[index]
+        candidates = sorted(set(card_id for source in card[2] for card_id in ids_by_source.get(source, []) if card_id in unmatched_ids))
+        if candidates:
+            unmatched_ids.remove(candidates[0])
+            changed.append((candidates[0], card))
+        else:
+            added.append(card)
+    return unchanged, changed, added, sorted(unmatched_ids)
+
+def read_current_cards(connection, deck):
+    cards = {}
+    for card_id, front, back in connection.execute("SELECT id, front, back FROM cards WHERE deck = ? AND removed_run IS NULL", (deck,)):
+        cards[card_id] = (front, back, set())
+    rows = connection.execute(
+        "SELECT card_id, card_sources.l, card_sources.v FROM card_sources JOIN cards ON cards.id = card_sources.card_id WHERE cards.deck = ? AND cards.removed_run IS NULL",
+        (deck,))
+    for card_id, language, value in rows:
+        cards[card_id][2].add((language, value))
+    return {card_id: (front, back, frozenset(sources)) for card_id, (front, back, sources) in cards.items()}
+
+def write_sources(connection, card_id, sources):
+    connection.execute("DELETE FROM card_sources WHERE card_id = ?", (card_id,))
+    connection.executemany("INSERT INTO card_sources (card_id, l, v) VALUES (?, ?, ?)", [(card_id, language, value) for language, value in sorted(sources, key=str)])
+
+def update_card_history(history_file, deck, word_maps):
+    """
+    Records the generated cards of a deck as a new run and returns its id.
+    Only cards that were added, changed or removed are written.
+    """
+    new_cards = [word_map_to_card(word_map) for word_map in word_maps]
+    with contextlib.closing(connect(history_file)) as connection:
+        with connection:
+            run = connection.execute("INSERT INTO runs (deck, created_at) VALUES (?, ?)", (deck, int(time.time()))).lastrowid
+            current_cards = read_current_cards(connection, deck)
+            unchanged, changed, added, removed = match_cards(current_cards, new_cards)
+            for card_id, (front, back, sources) in unchanged:
+                if current_cards[card_id][2] != sources:
+                    write_sources(connection, card_id, sources)
+            for card_id, (front, back, sources) in changed:
+                connection.execute("UPDATE cards SET front = ?, back = ?, last_changed_run = ? WHERE id = ?", (front, back, run, card_id))
+                write_sources(connection, card_id, sources)
+            for front, back, sources in added:
+                card_id = connection.execute(
+                    "INSERT INTO cards (deck, front, back, first_seen_run, last_changed_run) VALUES (?, ?, ?, ?, ?)",
+                    (deck, front, back, run, run)).lastrowid
+                write_sources(connection, card_id, sources)
+            connection.executemany("UPDATE cards SET removed_run = ?, last_changed_run = ? WHERE id = ?", [(run, run, card_id) for card_id in removed])
+    return run
+
+def import_anki_export(history_file, deck, anki_export):
+    """
+    Attaches GUIDs to the current cards of the deck with the same front and back as in the export.
+    Returns the number of cards that got a GUID.
+    """
+    guids = make_update_instructions.read_guids(anki_export)
+    with contextlib.closing(connect(history_file)) as connection:
+        with connection:
+            rows = connection.execute("SELECT id, front, back FROM cards WHERE deck = ? AND removed_run IS NULL", (deck,)).fetchall()
+            updates = [(guids[(front, back)], card_id) for card_id, front, back in rows if (front, back) in guids]
+            connection.executemany("UPDATE cards SET guid = ? WHERE id = ?", updates)
+    return len(updates)
+
+def find_changes(history_file, deck, since_run):
+    """
+    Returns the cards of the deck that were added, changed or removed after the given run, as (guid, front, back) tuples.
+    """
+    changes = {"added": [], "changed": [], "removed": []}
+    with contextlib.closing(connect(history_file)) as connection:
+        rows = connection.execute(
+            "SELECT guid, front, back, first_seen_run, removed_run FROM cards WHERE deck = ? AND last_changed_run > ? ORDER BY front, back",
+            (deck, since_run))
+        for guid, front, back, first_seen_run, removed_run in rows:
+            if first_seen_run > since_run:
+                if removed_run is None:
+                    changes["added"].append((guid, front, back))
+            elif removed_run is not None:
+                changes["removed"].append((guid, front, back))
+            else:
+                changes["changed"].append((guid, front, back))
+    return changes
+
+def main(args):
+    if args.command == "import-anki-export":
+        number_of_cards = import_anki_export(args.history, args.deck, args.anki_export)
+        print("Attached GUIDs to ", number_of_cards, " cards")
+    elif args.command == "changes":
+        changes = find_changes(args.history, args.deck, args.since_run)
+        print("Added cards:  ", len(changes["added"]))
+        print("Changed cards:", len(changes["changed"]))
+        print("Removed cards:", len(changes["removed"]))
+        removed = [(front, back) for _, front, back in changes["removed"]]
+        guids = {(front, back): guid for guid, front, back in changes["removed"] if guid is not None}
+        if removed:
+            print()
+            print(make_update_instructions.format_instructions(removed, guids), end="")
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
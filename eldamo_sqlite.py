@@ -0,0 +1,120 @@
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import xml.etree.ElementTree as ElementTree
+import generate
+
+DATABASE_FILE = "input/eldamo-data.sqlite"
+
+SCHEMA = """
+CREATE TABLE words (
+    id INTEGER PRIMARY KEY,
+    l TEXT,
+    v TEXT,
+    speech TEXT,
+    attributes TEXT NOT NULL
+);
+CREATE INDEX words_l ON words (l);
+CREATE INDEX words_v ON words (v);
+CREATE INDEX words_speech ON words (speech);
+CREATE TABLE word_links (
+    word_id INTEGER NOT NULL REFERENCES words (id),
+    position INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    l TEXT,
+    v TEXT,
+    attributes TEXT NOT NULL,
+    PRIMARY KEY (word_id, position)
+);
+CREATE INDEX word_links_target ON word_links (v, l);
+CREATE TABLE categories (
+    position INTEGER PRIMARY KEY,
+    id TEXT NOT NULL,
+    label TEXT
+);
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert the Eldamo data into an indexed SQLite database.')
+    parser.add_argument('--input', type=str, default=generate.INPUT_FILE, help='Eldamo XML file to import')
+    parser.add_argument('--database', type=str, default=DATABASE_FILE, help='SQLite database to create')
+
+    return parser.parse_args()
+
+def import_eldamo_data(root, database_file):
+    """
+    The database is built under a temporary name and moved into place, holding a lock so that parallel imports do not share that name.
+    """
+    with generate.file_lock(database_file):
+        temp_file = database_file + ".part"
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        connection = sqlite3.connect(temp_file)
+        try:
+            connection.executescript(SCHEMA)
+            for word_id, word in enumerate(root.iter("word")):
+                connection.execute(
+                    "INSERT INTO words (id, l, v, speech, attributes) VALUES (?, ?, ?, ?, ?)",
+                    (word_id, word.get('l'), word.get('v'), word.get('speech'), json.dumps(dict(word.attrib), ensure_ascii=False)))
+                links = [child for child in word if child.tag in generate.WORD_LINK_TAGS]
+                for position, link in enumerate(links):
+                    connection.execute(
+                        "INSERT INTO word_links (word_id, position, kind, l, v, attributes) VALUES (?, ?, ?, ?, ?, ?)",
+                        (word_id, position, link.tag, link.get('l'), link.get('v'), json.dumps(dict(link.attrib), ensure_ascii=False)))
+            for position, cat in enumerate(root.iter("cat-group")):
+                connection.execute(
+                    "INSERT INTO categories (position, id, label) VALUES (?, ?, ?)",
+                    (position, cat.get("id"), cat.get("label")))
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(temp_file, database_file)
+
+def connect_read_only(database_file):
+    if not os.path.exists(database_file):
+        raise ValueError(f"Database {database_file} not found. Create it with eldamo_sqlite.py first.")
+    return sqlite3.connect(f"file:{database_file}?mode=ro", uri=True)
+
+class SqliteEldamoDatabase:
+    """
+    Reads words from a database created by import_eldamo_data.
+    Every query uses its own read-only connection, so several threads and processes can share the same file.
+    Words are created anew for every query, so their base maps cannot be cached.
+    """
+    def __init__(self, database_file):
+        self.database_file = database_file
+        self.base_maps = None
+        with contextlib.closing(connect_read_only(database_file)) as connection:
+            rows = connection.execute("SELECT id, label FROM categories ORDER BY position").fetchall()
+        self.categories = [{ "id": cat_id, "label": label } for cat_id, label in rows]
+
+    def words_for_languages(self, language_ids):
+        placeholders = ", ".join("?" for _ in language_ids)
+        with contextlib.closing(connect_read_only(self.database_file)) as connection:
+            word_rows = connection.execute(
+                f"SELECT id, attributes FROM words WHERE l IN ({placeholders}) ORDER BY id",
+                list(language_ids)).fetchall()
+            link_rows = connection.execute(
+                f"SELECT word_id, kind, attributes FROM word_links WHERE word_id IN (SELECT id FROM words WHERE l IN ({placeholders})) ORDER BY word_id, position",
+                list(language_ids)).fetchall()
+
+        words = {}
+        for word_id, attributes in word_rows:
+            words[word_id] = ElementTree.Element("word", json.loads(attributes))
+        for word_id, kind, attributes in link_rows:
+            ElementTree.SubElement(words[word_id], kind, json.loads(attributes))
+        return list(words.values())
+
+def open_eldamo_database(database_file=DATABASE_FILE):
+    return SqliteEldamoDatabase(database_file)
+
+def main(args):
+    root = ElementTree.parse(args.input).getroot()
+    import_eldamo_data(root, args.database)
+    print("Written database to ", args.database)
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
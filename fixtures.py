@@ -0,0 +1,13 @@
+import functools
+import os
+import generate
+
+FIXTURE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data", "eldamo-fixture.xml")
+
+@functools.lru_cache(maxsize=None)
+def fixture_database():
+    """
+    The fixture file, parsed once per test run and shared between tests.
+    Tests must not modify it.
+    """
+    return generate.EldamoDatabase.from_file(FIXTURE_FILE, "stdlib")
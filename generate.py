@@ -1,12 +1,27 @@
 import argparse
+import collections
+import contextlib
 import copy
+import functools
+import hashlib
+import heapq
+import json
+import mmap
 import os
 import re
-import requests
+import sys
+import time
 import xml.etree.ElementTree as ElementTree
+from types import SimpleNamespace
 
 INPUT_URL = "https://github.com/pfstrack/eldamo/raw/master/src/data/eldamo-data.xml"
 INPUT_FILE = "input/eldamo-data.xml"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+CHECKPOINT_DIR = "input/checkpoints"
+OUTPUT_DIR = "output"
+FINGERPRINT_FILE = "input/fingerprints.json"
+# Options with side effects besides the output files, which a batch only has if it generates every deck.
+SIDE_EFFECT_OPTIONS = ["gzip", "card_history", "metrics_file"]
 
 SUPPORTED_LANGUAGES = []
 ADUNAIC = { "id": "ad", "name": "Adunaic" }
@@ -40,6 +55,26 @@ SUPPORTED_LANGUAGES.append(NEO_SINDARIN)
 TELERIN = { "id": "t", "name": "Telerin"}
 SUPPORTED_LANGUAGES.append(TELERIN)
 
+# The published decks, as (language, neo), generated in one run by the language "all".
+BATCH_LANGUAGE = "all"
+ALL_DECKS = [
+    ("Adunaic", False),
+    ("Black-Speech", False),
+    ("Early-Noldorin", False),
+    ("Early-Quenya", False),
+    ("Gnomish", False),
+    ("Khuzdul", False),
+    ("Noldorin", False),
+    ("Primitive", False),
+    ("Primitive", True),
+    ("Middle-Quenya", False),
+    ("Quenya", False),
+    ("Quenya", True),
+    ("Sindarin", False),
+    ("Sindarin", True),
+    ("Telerin", False),
+]
+
 SPEECH_INDIVIDUAL_NAMES = ["fem-name", "masc-name", "place-name"]
 SPEECH_COLLECTIVE_NAMES = "collective-name"
 SPEECH_PROPER_NAMES = "proper-name"
@@ -48,12 +83,81 @@ SPEECH_EXCLUDES = ["grammar", "phoneme", "phonetic-rule", "phonetic-group", "pho
 
 DEFUNCT_VERBS= ["can", "could", "may", "might", "must", "ought", "quoth", "said", "says", "shall", "should", "would"]
 
+DECK_OPTIONS = ["neo", "individual_names", "collective_names", "proper_names", "phrases", "include_archaic", "include_origin", "include_deprecated"]
+NEO_ONLY_DECK_OPTIONS = ["include_origin", "include_deprecated"]
+RUN_OPTIONS = { "verbose": False, "dedup_workers": 1, "card_history": None, "check": False, "overlays": None, "sort_order": "codepoint", "input_database": None }
+
+UNCERTAINTY_MARKERS = ["*", "?"]
+DEPRECATED_MARKER = "⚠️"
+ARCHAIC_MARKER = "†"
+# Variants of a translation differ only in these diacritics, uncertainty markers, casing or optional parts in parentheses.
+UNCERTAINTY_MARKER_PATTERN = r"[\*\?]"
+DIACRITIC_REPLACEMENTS = [
+    ("â", "á"),
+    ("Â", "Á"),
+    ("ê", "é"),
+    ("Ê", "É"),
+    ("î", "í"),
+    ("Î", "Í"),
+    ("ô", "ó"),
+    ("Ô", "Ó"),
+    ("û", "ú"),
+    ("Û", "Ú"),
+    ("ŷ", "ý"),
+    ("Ŷ", "Ý"),
+    ("ä", "a"),
+    ("Ä", "A"),
+    ("ë", "e"),
+    ("Ë", "E"),
+    ("ï", "i"),
+    ("Ï", "I"),
+    ("ö", "o"),
+    ("Ö", "O"),
+    ("ü", "u"),
+    ("Ü", "U"),
+    ("ÿ", "y"),
+    ("Ÿ", "Y")
+]
+# Brackets, separators and markers are the only characters the gloss tokenizer has to look at.
+GLOSS_SPECIAL_CHARACTERS = r"[(\[{]|[)\]}]|[,;]|⚠️|†"
+# Translations that already contain a "to" for verbs, possibly after a marker like * or (lit.).
+VERB_WITH_TO = r"[^a-zA-Z]?to |\(lit\.\) to|\(orig\.\) to"
+WORD_LINK_TAGS = ["see", "deprecated"]
+XML_DECLARATION = r"^\s*<\?xml[^>]*\?>"
+
+PARSER_BACKENDS = ["auto", "lxml", "stdlib", "parallel"]
+# Comments, CDATA sections and processing instructions are matched as a whole (group 1), so that a <word> inside them
+# is not mistaken for a word start tag (group 2) or end tag (group 3).
+WORD_TAGS = rb"(?s)(<!--.*?-->|<!\[CDATA\[.*?\]\]>|<\?.*?\?>)|(<word(?=[\s/>])(?:[^>\"']|\"[^\"]*\"|'[^']*')*>)|(</word\s*>)"
+WORD_PLACEHOLDER_TAG = "eldamo-top-level-word"
+WORD_PLACEHOLDER = f"<{WORD_PLACEHOLDER_TAG}/>".encode("utf-8")
+PARSE_CHUNKS_PER_WORKER = 4
+
+STAGES = ["filter", "map", "dedup", "format"]
+METRICS_FORMATS = ["json", "prometheus"]
+FILTER_REASONS = ["deprecated", "archaic", "speech", "missing_value", "missing_translation"]
+STAGE_OPTIONS = {
+    "filter": ["neo", "individual_names", "collective_names", "proper_names", "phrases", "include_archaic", "include_deprecated"],
+    "map": DECK_OPTIONS,
+    "dedup": DECK_OPTIONS,
+}
+
 DELIMITER = "|"
+SORT_ORDERS = ["codepoint", "elvish"]
+# Letters without a Unicode decomposition, sorted like their transcriptions.
+ELVISH_LETTERS = { "þ": "th", "ð": "dh", "ƀ": "bh", "ŋ": "ng", "æ": "ae", "œ": "oe" }
 UNGLOSSED = "[unglossed]"
 
+@functools.lru_cache(maxsize=None)
+def get_regex(pattern):
+    """
+    Patterns are compiled on first use, so that importing this module stays cheap.
+    """
+    return re.compile(pattern)
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Generate text files that are easily imported with Anki.')
-    parser.add_argument('language', type=str, help='Language to generate')
+    parser.add_argument('language', type=str, help='Language to generate, or "all" for all published decks')
     parser.add_argument('--neo', action='store_true', default=False, help='Assemble Neo-Eldarin lists, drawing from words invented by Tolkien throughout his life as well as fan-invented words')
     parser.add_argument('--individual-names', action='store_true', default=False, help='Include names of individuals and places')
     parser.add_argument('--collective-names', action='store_true', default=False, help='Include names for collective people')
@@ -63,31 +167,297 @@ def parse_args():
     parser.add_argument('--include-origin', action='store_true', default=False, help='Include the linguistic origin of the word in the card')
     parser.add_argument('--include-deprecated', action='store_true', default=False, help='Include words that Paul Strack has marked as deprecated in neo lists')
     parser.add_argument('--check-for-updates', action='store_true', default=False, help='Forces a re-download of the Eldamo database')
+    parser.add_argument('--input-database', type=str, default=None, help='Read the Eldamo data from a SQLite database created by eldamo_sqlite.py')
+    parser.add_argument('--overlay', dest='overlays', action='append', default=None, help='XML or CSV file with words that are merged into the Eldamo data by their value and language; can be given several times')
+    parser.add_argument('--parser', type=str, choices=PARSER_BACKENDS, default="auto", help='XML parser to use; auto uses lxml if it is installed, parallel parses chunks of the file in a process pool')
+    parser.add_argument('--stream-download', action='store_true', default=False, help='Parse the Eldamo database while it is being downloaded; the parallel parser falls back to stdlib while streaming')
+    parser.add_argument('--checkpoints', action='store_true', default=False, help='Store the intermediate results of each stage, so that later stages can be re-run with --from-stage')
+    parser.add_argument('--from-stage', type=str, choices=STAGES[1:], default=None, help='Resume from the checkpoint before this stage, falling back to earlier checkpoints if necessary')
+    parser.add_argument('--dedup-workers', type=int, default=1, help='Number of processes used to remove duplicates')
+    parser.add_argument('--sort-order', type=str, choices=SORT_ORDERS, default="codepoint", help='Order of the cards; elvish sorts letters with diacritics among their base letters, ignoring case and punctuation')
+    parser.add_argument('--gzip', action='store_true', default=False, help='Additionally write a gzip compressed copy of the output')
+    parser.add_argument('--check', action='store_true', default=False, help='Only compare the generated cards with the output files, without writing them; exits with an error if any deck changed')
+    parser.add_argument('--card-history', type=str, default=None, help='Record the generated cards in the given card history database, see card_history.py')
+    parser.add_argument('--metrics-file', type=str, default=None, help='Record card counts, filtered words, merged duplicates, stage durations and cache usage of this deck in the given file')
+    parser.add_argument('--metrics-format', type=str, choices=METRICS_FORMATS, default="json", help='Format of the metrics file; prometheus writes the textfile collector format')
     parser.add_argument('--verbose', action='store_true', default=False, help='Print more output')
 
     return parser.parse_args()
 
+@contextlib.contextmanager
+def file_lock(filename):
+    """
+    Holds an exclusive lock on filename + ".lock" and yields whether another process was holding it first.
+    Without fcntl, e.g. on Windows, nothing is locked.
+    """
+    dir_name = os.path.dirname(filename)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name, exist_ok=True)
+    try:
+        import fcntl
+    except ImportError:
+        yield False
+        return
+    with open(filename + ".lock", 'a') as lock_file:
+        was_locked = False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            was_locked = True
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield was_locked
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def was_downloaded_meanwhile(args, was_locked):
+    """
+    Only downloads take the lock of the input file, so a process that had to wait for it can use the data just downloaded.
+    """
+    if not needs_download(args):
+        return True
+    if was_locked and os.path.exists(INPUT_FILE):
+        print("Using the Eldamo data downloaded by another process")
+        return True
+    return False
+
 def ensure_endamo_data(args):
     dir_name = os.path.dirname(INPUT_FILE)
 
     if not os.path.exists(dir_name):
-        os.makedirs(dir_name)
+        os.makedirs(dir_name, exist_ok=True)
 
-    if not os.path.exists(INPUT_FILE) or args.check_for_updates:
+    if not needs_download(args):
+        return
+    with file_lock(INPUT_FILE) as was_locked:
+        if was_downloaded_meanwhile(args, was_locked):
+            return
+        import requests
         print("Downloading Eldamo data from ", INPUT_URL, "...")
         response = requests.get(INPUT_URL)
-        with open(INPUT_FILE, 'wb') as file:
-            file.write(response.content)
+        response.raise_for_status()
+        write_file_atomically(INPUT_FILE, response.content)
+
+def needs_download(args):
+    return not os.path.exists(INPUT_FILE) or args.check_for_updates
+
+def stream_endamo_data(backend="auto"):
+    """
+    Callers hold the lock of the input file, as the partial download has a fixed name.
+    A download stream cannot be split into chunks, so the parallel backend parses it with stdlib.
+    """
+    dir_name = os.path.dirname(INPUT_FILE)
+
+    if not os.path.exists(dir_name):
+        os.makedirs(dir_name, exist_ok=True)
+
+    import requests
+    print("Downloading and parsing Eldamo data from ", INPUT_URL, "...")
+    temp_file = INPUT_FILE + ".part"
+    backend = get_parser_backend(backend)
+    if backend == "lxml":
+        import lxml.etree
+        parser = lxml.etree.XMLPullParser(events=("start",))
+    else:
+        if backend == "parallel":
+            print("The parallel parser cannot split a download, parsing it with stdlib")
+        parser = ElementTree.XMLPullParser(events=("start",))
+    root = None
+    try:
+        with requests.get(INPUT_URL, stream=True) as response:
+            response.raise_for_status()
+            with open(temp_file, 'wb') as file:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    file.write(chunk)
+                    parser.feed(chunk)
+                    for _, element in parser.read_events():
+                        if root is None:
+                            root = element
+        parser.close()
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    os.replace(temp_file, INPUT_FILE)
+    return root
+
+def load_endamo_data(args):
+    if args.stream_download and needs_download(args):
+        with file_lock(INPUT_FILE) as was_locked:
+            if not was_downloaded_meanwhile(args, was_locked):
+                root = stream_endamo_data(args.parser)
+                return root.findall(".//word"), read_categories(root)
+    else:
+        ensure_endamo_data(args)
+    return read_endamo_data(INPUT_FILE, args.parser)
+
+def get_parser_backend(name):
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend: {name}")
+    if name in ["stdlib", "parallel"]:
+        return name
+    try:
+        import lxml.etree
+    except ImportError:
+        if name == "lxml":
+            raise ValueError("The lxml parser backend requires the lxml package")
+        return "stdlib"
+    return "lxml"
+
+def parse_with_stdlib(filename):
+    root = ElementTree.parse(filename).getroot()
+    return root.findall(".//word"), read_categories(root)
+
+def parse_with_lxml(filename):
+    import lxml.etree
+    find_words = lxml.etree.XPath("//word")
+    find_categories = lxml.etree.XPath("//cat-group")
+    tree = lxml.etree.parse(filename)
+    categories = [{ "id": cat.get("id"), "label": cat.get("label") } for cat in find_categories(tree)]
+    return find_words(tree), categories
+
+def find_range_start(data, position):
+    """
+    Returns the position of the first word start tag at or after position that is not inside a comment, CDATA section or processing instruction.
+    """
+    while True:
+        position = data.find(b"<word", position)
+        if position == -1:
+            return len(data)
+        for opening, closing in [(b"<!--", b"-->"), (b"<![CDATA[", b"]]>"), (b"<?", b"?>")]:
+            if data.rfind(opening, 0, position) > data.rfind(closing, 0, position):
+                position = data.find(closing, position)
+                break
+        else:
+            if data[position + 5:position + 6] in [b" ", b"\t", b"\r", b"\n", b"/", b">"]:
+                return position
+            position += 1
 
-def read_endamo_data():
+def scan_word_tags(filename, start, end):
+    """
+    Scans a range of the file that starts at a word start tag, without knowing how deeply that tag is nested.
+    Returns the change in nesting depth over the range, and the start and end positions of the words that begin and end
+    at each nesting depth relative to the start of the range, as far as that depth is zero or less.
+    """
+    depth = 0
+    starts = {}
+    ends = {}
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for match in get_regex(WORD_TAGS).finditer(data, start, end):
+                kind = match.lastindex
+                if kind == 2:
+                    if depth <= 0:
+                        starts.setdefault(depth, []).append(match.start())
+                    if data[match.end() - 2] == ord("/"):
+                        if depth <= 0:
+                            ends.setdefault(depth, []).append(match.end())
+                    else:
+                        depth += 1
+                elif kind == 3:
+                    depth -= 1
+                    if depth <= 0:
+                        ends.setdefault(depth, []).append(match.end())
+    return depth, starts, ends
+
+def parse_word_chunk(filename, region_start, spans):
+    """
+    Parses a chunk of top-level words into compact records of all words in it, including the nested ones.
+    Categories inside the words are returned with the index of their top-level word within the chunk.
+    The rest of the chunk is returned with a placeholder for every top-level word.
+    """
+    skeleton = []
+    words = []
+    position = region_start
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start, end in spans:
+                skeleton.append(data[position:start])
+                skeleton.append(WORD_PLACEHOLDER)
+                words.append(data[start:end])
+                position = end
+    chunk = ElementTree.fromstring(b"<chunk>" + b"".join(words) + b"</chunk>")
+    records = []
+    categories = []
+    for index, top_level_word in enumerate(chunk):
+        records.extend(word_to_record(word) for word in top_level_word.iter("word"))
+        categories.extend((index, { "id": cat.get("id"), "label": cat.get("label") }) for cat in top_level_word.iter("cat-group"))
+    return records, categories, b"".join(skeleton)
+
+def parse_in_parallel(filename, workers=None):
+    """
+    Parses the memory-mapped file in a process pool.
+    First, ranges of the file are scanned for word tags to find the top-level words, i.e. the ones not nested in another word.
+    Then chunks of top-level words are parsed, and the rest of the document is parsed with a placeholder for every
+    top-level word, so that the categories keep their document order.
+    References between words are resolved by value later on, so they work across chunks.
+    """
+    workers = workers or os.cpu_count() or 1
+    number_of_ranges = workers * PARSE_CHUNKS_PER_WORKER
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            size = len(data)
+            range_starts = sorted(set(find_range_start(data, size * i // number_of_ranges) for i in range(number_of_ranges)))
+            head = data[:range_starts[0]]
+    ranges = list(zip(range_starts, range_starts[1:] + [size]))
+    ranges = [(start, end) for start, end in ranges if start < end]
+
+    executor = None
+    if workers > 1 and len(ranges) > 1:
+        import concurrent.futures
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
     try:
-        tree = ElementTree.parse(INPUT_FILE)
-        root = tree.getroot()
-        return root
-    except FileNotFoundError:
-        print(f"File {INPUT_FILE} not found.")
+        map_in_pool = executor.map if executor is not None else map
+        top_level_starts = []
+        top_level_ends = []
+        depth = 0
+        for depth_change, starts, ends in map_in_pool(scan_word_tags, [filename] * len(ranges), *zip(*ranges)):
+            top_level_starts.extend(starts.get(-depth, []))
+            top_level_ends.extend(ends.get(-depth, []))
+            depth += depth_change
+        spans = list(zip(top_level_starts, top_level_ends))
+
+        chunk_size = max(1, -(-len(spans) // number_of_ranges))
+        chunks = [spans[i:i + chunk_size] for i in range(0, len(spans), chunk_size)]
+        region_starts = [range_starts[0]] + [chunk[-1][1] for chunk in chunks[:-1]]
+        results = list(map_in_pool(parse_word_chunk, [filename] * len(chunks), region_starts, chunks))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            tail = data[spans[-1][1]:] if spans else data[range_starts[0]:]
+    root = ElementTree.fromstring(head + b"".join(skeleton for _, _, skeleton in results) + tail)
+
+    words = []
+    categories_by_top_level_word = {}
+    for chunk_index, (records, chunk_categories, _) in enumerate(results):
+        words.extend(record_to_word(record) for record in records)
+        for index, category in chunk_categories:
+            categories_by_top_level_word.setdefault(chunk_index * chunk_size + index, []).append(category)
+
+    categories = []
+    top_level_word = 0
+    for element in root.iter():
+        if element.tag == "cat-group":
+            categories.append({ "id": element.get("id"), "label": element.get("label") })
+        elif element.tag == WORD_PLACEHOLDER_TAG:
+            categories.extend(categories_by_top_level_word.get(top_level_word, []))
+            top_level_word += 1
+    return words, categories
+
+def read_endamo_data(filename=INPUT_FILE, backend="auto"):
+    backend = get_parser_backend(backend)
+    if not os.path.exists(filename):
+        print(f"File {filename} not found.")
         return None
-    
+    if backend == "lxml":
+        return parse_with_lxml(filename)
+    if backend == "parallel":
+        return parse_in_parallel(filename)
+    return parse_with_stdlib(filename)
+
 def get_languages_to_generate(args):
     languages = []
     is_supported = False
@@ -126,35 +496,29 @@ def get_speech_types_to_exclude(args):
     return speech_types
 
 def debug_print_word(word):
-    element_string = ElementTree.tostring(word, encoding='utf-8').decode('utf-8')
+    if type(word).__module__.startswith("lxml"):
+        import lxml.etree
+        element_string = lxml.etree.tostring(word, encoding='utf-8').decode('utf-8')
+    else:
+        element_string = ElementTree.tostring(word, encoding='utf-8').decode('utf-8')
     print(element_string)
 
-def find_referenced_word(referencer, all_words):
-    see_element = referencer.find('see')
+def find_see_value(word):
+    see_element = word.find('see')
     if see_element is None:
         return None
-    reference = see_element.get('v')
-    if reference is None:
-        return None
-    for word in all_words:
-        if word.get('v') == reference:
-            return word
-    return None
+    return see_element.get('v')
 
-def find_translation(all_words, word, args):
+def find_translation(base_map, base_maps_by_value, args):
     english_word = None
     if args.neo:
-        english_word = word.get('ngloss')
-    if english_word == UNGLOSSED:
-        english_word = None
-    if english_word is None:
-        english_word = word.get('gloss')
-    if english_word == UNGLOSSED:
-        english_word = None
+        english_word = base_map["ngloss"]
     if english_word is None:
-        referenced_word = find_referenced_word(word, all_words)
-        if referenced_word is not None:
-            english_word = find_translation(all_words, referenced_word, args)
+        english_word = base_map["gloss"]
+    if english_word is None and base_map["see"] is not None:
+        referenced_base_map = base_maps_by_value.get(base_map["see"])
+        if referenced_base_map is not None:
+            english_word = find_translation(referenced_base_map, base_maps_by_value, args)
     return english_word
 
 def get_category(word, categories):
@@ -187,8 +551,8 @@ def include_tengwar_info_for_quenya(word):
     if word["tolkienian_word"].startswith("W"):
         word["tolkienian_word"] = "V" + word["tolkienian_word"][1:]
     w_pattern = r'(?<=[aeiou])(?<!ai)(?<!oi)w'
-    if re.search(w_pattern, word["tolkienian_word"]):
-        word["tolkienian_word"] = re.sub(w_pattern, 'v', word["tolkienian_word"])
+    if get_regex(w_pattern).search(word["tolkienian_word"]):
+        word["tolkienian_word"] = get_regex(w_pattern).sub('v', word["tolkienian_word"])
     
     tengwar_info = word.get("tengwar")
     if tengwar_info is not None and tengwar_info != "w":
@@ -249,24 +613,21 @@ def normalise_quenya_spelling(word):
         (r'e(?=\s|$)', 'ë'),
     ]
     for pattern in patterns:
-        if re.search(pattern[0], word["tolkienian_word"]):
-            word["tolkienian_word"] = re.sub(pattern[0], pattern[1], word["tolkienian_word"])
+        regex = get_regex(pattern[0])
+        if regex.search(word["tolkienian_word"]):
+            word["tolkienian_word"] = regex.sub(pattern[1], word["tolkienian_word"])
 
 def remove_translations_after_marker(word, marker):
-    if marker in word["english_word"]:
-        index = word["english_word"].find(marker)
-        word["english_word"] = word["english_word"][:index]
-    
-    word["english_word"] = word["english_word"].strip()
-    
-    if word["english_word"].endswith(',') or word["english_word"].endswith(';'):
-        word["english_word"] = word["english_word"][:-1].strip()
+    gloss = word["english_word"]
+    end, _, _ = scan_gloss(gloss, [marker])
+    start, end = trim_gloss(gloss, 0, end, 1)
+    word["english_word"] = gloss[start:end]
 
 def remove_deprecated_translations(word):
-    remove_translations_after_marker(word, '⚠️')
+    remove_translations_after_marker(word, DEPRECATED_MARKER)
 
 def remove_archaic_translations(word):
-    remove_translations_after_marker(word, '†')
+    remove_translations_after_marker(word, ARCHAIC_MARKER)
 
 def remove_duplication_marker(word):
     word["tolkienian_word"] = word["tolkienian_word"].replace("¹", "")
@@ -280,108 +641,227 @@ def remove_duplication_marker(word):
     word["tolkienian_word"] = word["tolkienian_word"].replace("⁹", "")
     word["tolkienian_word"] = word["tolkienian_word"].replace("⁰", "")
 
-def word_to_map(all_words, word, categories, args):
-    word_map = {}
-    word_map["tolkienian_word"] = word.get('v')
-    if word_map.get("tolkienian_word") is None:
+def clean_translation(translation):
+    if translation is None or translation == UNGLOSSED:
+        return None
+    return translation.replace("&", "and").replace(DELIMITER, "")
+
+def word_to_base_map(word, categories):
+    """
+    Everything about a card that does not depend on the command line options.
+    The English translation is resolved later, because it depends on --neo and on the words that passed the filters.
+    """
+    base_map = {}
+    base_map["value"] = word.get('v')
+    base_map["tolkienian_word"] = word.get('v')
+    base_map["gloss"] = clean_translation(word.get('gloss'))
+    base_map["ngloss"] = clean_translation(word.get('ngloss'))
+    base_map["see"] = find_see_value(word) if base_map["gloss"] is None else None
+    base_map["part_of_speech"] = word.get('speech')
+    base_map["stem"] = word.get('stem')
+    base_map["category"] = get_category(word, categories)
+    base_map["tengwar"] = word.get('tengwar')
+    base_map["language"] = word.get('l')
+
+    for key in ["tolkienian_word", "part_of_speech", "stem", "category", "tengwar", "language"]:
+        if base_map.get(key) is not None:
+            base_map[key] = base_map[key].replace(DELIMITER, "")
+
+    if base_map["tolkienian_word"] is not None:
+        remove_duplication_marker(base_map)
+
+        include_stem_info(base_map)
+
+        include_tengwar_info(base_map)
+
+        if is_quenya(base_map):
+            normalise_quenya_spelling(base_map)
+
+    return base_map
+
+def get_base_map(word, categories, base_maps):
+    base_map = base_maps.get(id(word))
+    if base_map is None:
+        base_map = word_to_base_map(word, categories)
+        base_maps[id(word)] = base_map
+    return base_map
+
+def word_to_map(word, base_map, base_maps_by_value, args):
+    if base_map["tolkienian_word"] is None:
         if args.verbose:
             print("Skipping word without value: ")
             debug_print_word(word)
         return None
-    word_map["english_word"] = find_translation(all_words, word, args)
-    if word_map.get("english_word") is None:
+    english_word = find_translation(base_map, base_maps_by_value, args)
+    if english_word is None:
         if args.verbose:
-            print("Skipping word without translation: ", word_map.get("tolkienian_word"))
+            print("Skipping word without translation: ", base_map["value"])
         return None
-    word_map["english_word"] = word_map["english_word"].replace("&", "and")
-    word_map["part_of_speech"] = word.get('speech')
-    word_map["stem"] = word.get('stem')
-    word_map["category"] = get_category(word, categories)
-    word_map["tengwar"] = word.get('tengwar')
-    word_map["language"] = word.get('l')
-
-    for key in word_map.keys():
-        if word_map.get(key) is not None:
-            word_map[key] = word_map[key].replace(DELIMITER, "")
 
-    if args.neo:
-        if not args.include_deprecated:
-            remove_deprecated_translations(word_map)
-        if not args.include_origin:
-            remove_origin_marker(word_map)
-    if not args.include_archaic:
-        remove_archaic_translations(word_map)
-
-    remove_duplication_marker(word_map)
-
-    include_stem_info(word_map)
-    
-    include_tengwar_info(word_map)
+    word_map = {"tolkienian_word": base_map["tolkienian_word"], "english_word": english_word}
+    for key, value in base_map.items():
+        if key not in ["value", "tolkienian_word", "gloss", "ngloss", "see"]:
+            word_map[key] = value
+    word_map["sources"] = [[base_map["language"], base_map["value"]]]
 
-    if is_quenya(word_map):
-        normalise_quenya_spelling(word_map)
+    if args.neo and not args.include_origin:
+        remove_origin_marker(word_map)
 
     return word_map
 
-def split_string_outside_parenthesis(string):
-    parts = []
-    temp = ""
-    depth = 0
+def get_gloss_markers(args):
+    """
+    Markers after which the translations are dropped, in the order in which they are applied.
+    """
+    markers = []
+    if args.neo and not args.include_deprecated:
+        markers.append(DEPRECATED_MARKER)
+    if not args.include_archaic:
+        markers.append(ARCHAIC_MARKER)
+    return markers
 
-    for char in string:
+def scan_gloss(gloss, markers):
+    """
+    Scans the gloss up to the first of the markers.
+    Returns the position of that marker (or the end of the gloss), the positions of the commas and semicolons outside of brackets before it, and the marker.
+    """
+    separators = []
+    depth = 0
+    for match in get_regex(GLOSS_SPECIAL_CHARACTERS).finditer(gloss):
+        char = match.group()
         if char in "([{":
             depth += 1
         elif char in ")]}":
             depth -= 1
-        elif char in ",;" and depth == 0:
-            if temp:
-                parts.append(temp)
-                temp = ""
-            continue
-        temp += char
-
-    if temp:
-        parts.append(temp)
-
-    return parts
-
-def split_word_map(word_map):
+        elif char in ",;":
+            if depth == 0:
+                separators.append(match.start())
+        elif char in markers:
+            return match.start(), separators, char
+    return len(gloss), separators, None
+
+def trim_gloss(gloss, start, end, passes):
+    """
+    Strips whitespace and one trailing comma or semicolon from gloss[start:end], once per pass.
+    """
+    for _ in range(passes):
+        while start < end and gloss[start].isspace():
+            start += 1
+        while end > start and gloss[end - 1].isspace():
+            end -= 1
+        if end > start and gloss[end - 1] in ",;":
+            end -= 1
+            while end > start and gloss[end - 1].isspace():
+                end -= 1
+    return start, end
+
+def tokenize_gloss(gloss, markers=(), is_verb=False):
+    """
+    Splits a gloss into translations in a single scan: at commas and semicolons outside of brackets, dropping everything after the first of the markers.
+    Translations of verbs get a "to" prepended unless they already have one or are defunct verbs.
+    """
+    end, separators, marker = scan_gloss(gloss, markers)
+    # Every marker trims the end of the gloss, but markers found earlier in the gloss discard the trimming of the ones before them.
+    passes = len(markers) if marker is None else len(markers) - markers.index(marker)
+    start, end = trim_gloss(gloss, 0, end, passes)
+
+    tokens = []
+    boundaries = [separator for separator in separators if separator < end]
+    boundaries.append(end)
+    for separator in boundaries:
+        if separator > start:
+            english_word = gloss[start:separator].strip()
+            if is_verb and not get_regex(VERB_WITH_TO).match(english_word) and english_word not in DEFUNCT_VERBS:
+                english_word = "to " + english_word
+                english_word = english_word.replace("to (lit.)", "(lit.) to")
+                english_word = english_word.replace("to (orig.)", "(orig.) to")
+            tokens.append(english_word)
+        start = separator + 1
+    return tokens
+
+def split_word_map(word_map, markers=()):
     maps = []
-    english_words = split_string_outside_parenthesis(word_map["english_word"])
-    for english_word in english_words:
-        new_map = copy.deepcopy(word_map)
-        english_word = english_word.strip()
-        if needs_added_to(word_map, english_word):
-            english_word = "to " + english_word
-            english_word = english_word.replace("to (lit.)", "(lit.) to")
-            english_word = english_word.replace("to (orig.)", "(orig.) to")
+    is_verb = word_map.get("part_of_speech") == "vb"
+    for english_word in tokenize_gloss(word_map["english_word"], markers, is_verb):
+        new_map = word_map.copy()
         new_map["english_word"] = english_word
         maps.append(new_map)
     return maps
 
-def needs_added_to(word_map, english_word):
-    if not word_map.get("part_of_speech") == "vb":
-        return False
-    if english_word.startswith("to "):
-        return False
-    starts_with_non_alphanumeric_and_then_to = bool(re.match(r"^(?:[^a-zA-Z]?to )", english_word))
-    if starts_with_non_alphanumeric_and_then_to:
-        return False
-    if english_word.startswith("(lit.) to"):
-        return False
-    if english_word.startswith("(orig.) to"):
-        return False
-    if english_word in DEFUNCT_VERBS:
-        return False
-    return True
-    
-def words_to_maps(words, categories, args):
+
+def get_mapping_mode(args, neo):
+    """
+    The options that change how a word is mapped to cards.
+    """
+    return (neo, neo and args.include_origin, neo and args.include_deprecated, args.include_archaic)
+
+def is_changed_by_neo_steps(base_map):
+    """
+    Whether the cards of a word with a gloss may differ between plain and Neo decks.
+    They do if the word has an ngloss, an origin marker or the deprecation marker, which also trims a trailing separator once more.
+    """
+    gloss = base_map["gloss"]
+    return base_map["ngloss"] is not None or "[" in gloss or DEPRECATED_MARKER in gloss or gloss.rstrip().endswith((",", ";"))
+
+def find_cached_maps(card_set, word, base_map, mode, plain_mode=None):
+    """
+    Returns copies of the cards of the word if they are in the card set of its language for this mode.
+    Neo decks pass the plain mode, because they can use the cards of plain decks for words that the Neo steps do not change.
+    """
+    maps = card_set.get(mode, {}).get(id(word))
+    if maps is None and plain_mode is not None and base_map["gloss"] is not None and not is_changed_by_neo_steps(base_map):
+        maps = card_set.get(plain_mode, {}).get(id(word))
+    if maps is None:
+        return None
+    return [word_map.copy() for word_map in maps]
+
+def words_to_maps(words, categories, args, base_maps=None, metrics=None, card_sets=None):
+    """
+    Base maps can be cached across calls in base_maps, as long as the words and categories stay the same.
+    Under the same condition, the cards of the languages in card_sets are cached there per mode, so that decks sharing a language map its words only once.
+    Words referencing another word are always mapped again, because their translation depends on the other words of the deck.
+    """
+    if base_maps is None:
+        base_maps = {}
+    if card_sets is None:
+        card_sets = {}
+    cached_base_maps = len(base_maps)
+    word_base_maps = [get_base_map(word, categories, base_maps) for word in words]
+    if metrics is not None:
+        misses = len(base_maps) - cached_base_maps
+        count_cache_usage(metrics, "base_maps", len(words) - misses, misses)
+    base_maps_by_value = {}
+    for base_map in word_base_maps:
+        base_maps_by_value.setdefault(base_map["value"], base_map)
+
+    markers = get_gloss_markers(args)
+    mode = get_mapping_mode(args, args.neo)
+    plain_mode = get_mapping_mode(args, False) if args.neo else None
     word_maps = []
-    for word in words:
-        word_map = word_to_map(words, word, categories, args)
+    hits = 0
+    misses = 0
+    for word, base_map in zip(words, word_base_maps):
+        card_set = card_sets.get(base_map["language"]) if base_map["see"] is None else None
+        if card_set is not None:
+            split_maps = find_cached_maps(card_set, word, base_map, mode, plain_mode)
+            if split_maps is not None:
+                hits += 1
+                word_maps.extend(split_maps)
+                continue
+            misses += 1
+        word_map = word_to_map(word, base_map, base_maps_by_value, args)
         if word_map is not None:
-            split_maps = split_word_map(word_map)
+            split_maps = split_word_map(word_map, markers)
+            if card_set is not None:
+                # Deduplication modifies the cards, so the cached ones are copied.
+                card_set.setdefault(mode, {})[id(word)] = split_maps
+                split_maps = [split_map.copy() for split_map in split_maps]
             word_maps.extend(split_maps)
+        elif metrics is not None:
+            reason = "missing_value" if base_map["tolkienian_word"] is None else "missing_translation"
+            metrics["filtered_out"][reason] += 1
+    if metrics is not None and card_sets:
+        count_cache_usage(metrics, "card_sets", hits, misses)
     return word_maps
 
 def find_tolkienian_duplicates(all_words, word_input):
@@ -417,7 +897,6 @@ def are_english_duplicates(word1, word2):
         return False
     ew1 = word1.get("english_word")
     ew2 = word2.get("english_word")
-    UNCERTAINTY_MARKERS = ["*", "?"]
     for marker in UNCERTAINTY_MARKERS:
         ew1 = ew1.replace(marker, "")
         ew2 = ew2.replace(marker, "")
@@ -456,40 +935,21 @@ def invalidate_word(word):
     word["tolkienian_word"] = None
     word["english_word"] = None
 
+def fold_variant(text):
+    """
+    Applies the folding of is_contained_in_variants unconditionally, so that all variants of a text fold to the same one.
+    """
+    text = text.lower()
+    for diacritic, replacement in DIACRITIC_REPLACEMENTS:
+        text = text.replace(diacritic, replacement)
+    return get_regex(UNCERTAINTY_MARKER_PATTERN).sub('', text)
+
 def is_contained_in_variants(word, variant):
     if word == variant:
         return False
 
-    MARKERS = ["*", "?"]
-    MARKER_PATTERN = r"[\*\?]"
-    DIACRITIC_REPLACEMENTS = [
-        ("â", "á"),
-        ("Â", "Á"),
-        ("ê", "é"),
-        ("Ê", "É"),
-        ("î", "í"),
-        ("Î", "Í"),
-        ("ô", "ó"),
-        ("Ô", "Ó"),
-        ("û", "ú"),
-        ("Û", "Ú"),
-        ("ŷ", "ý"),
-        ("Ŷ", "Ý"),
-        ("ä", "a"),
-        ("Ä", "A"),
-        ("ë", "e"),
-        ("Ë", "E"),
-        ("ï", "i"),
-        ("Ï", "I"),
-        ("ö", "o"),
-        ("Ö", "O"),
-        ("ü", "u"),
-        ("Ü", "U"),
-        ("ÿ", "y"),
-        ("Ÿ", "Y")
-    ]
     is_variant = "(" in variant and ")" in variant
-    has_marker = any(marker in word for marker in MARKERS)
+    has_marker = any(marker in word for marker in UNCERTAINTY_MARKERS)
     has_diacritic = any(diacritic[0] in variant for diacritic in DIACRITIC_REPLACEMENTS)
     wordContainsUppercase = word != word.lower()
     variantContainsUppercase = variant != variant.lower()
@@ -506,11 +966,11 @@ def is_contained_in_variants(word, variant):
             variant = variant.replace(diacritic[0], diacritic[1])
     
     if has_marker:
-        word = re.sub(MARKER_PATTERN, '', word)
+        word = get_regex(UNCERTAINTY_MARKER_PATTERN).sub('', word)
     
     if is_variant:
         longer_variant = variant.replace("(", "").replace(")", "")
-        shorter_variant = re.sub(r'\(.*?\)', '', variant).strip()
+        shorter_variant = get_regex(r'\(.*?\)').sub('', variant).strip()
         return word == longer_variant or word == shorter_variant
     else:
         return word == variant
@@ -538,6 +998,9 @@ def merge_duplicates(duplicates, field_to_merge):
     values_to_merge = remove_duplicate_translations(values_to_merge)
 
     merged_values = "; ".join(values_to_merge)
+    sources = sorted(set(tuple(source) for word in duplicates for source in word.get("sources", [])), key=lambda source: (source[0] or "", source[1] or ""))
+    if sources:
+        duplicates[0]["sources"] = [list(source) for source in sources]
     
     for i in range(0, len(duplicates)):
         if i == 0:
@@ -554,18 +1017,57 @@ def make_tolkienian_duplicates_unique(duplicates):
     if len(duplicates) > 1:
         merge_duplicates(duplicates, "english_word")
 
-def is_extra_info_necessary(word_with_extra_info, all_words):
-    duplicates = [word for word in all_words if word.get("tolkienian_word") == word_with_extra_info.get("tolkienian_word")]
-    duplicates = [word for word in duplicates if word.get("english_word") != word_with_extra_info.get("english_word")]
-    return len(duplicates) > 0
+def is_extra_info_necessary(word_with_extra_info, english_words_by_tolkienian):
+    english_words = english_words_by_tolkienian[word_with_extra_info.get("tolkienian_word")]
+    return any(english_word != word_with_extra_info.get("english_word") for english_word in english_words)
 
 def remove_unnecessary_extra_info(all_words):
+    english_words_by_tolkienian = {}
+    for word in all_words:
+        english_words_by_tolkienian.setdefault(word.get("tolkienian_word"), set()).add(word.get("english_word"))
     for word in all_words:
         hasExtraInfo = word.get("extra_info") is not None
-        if hasExtraInfo and not is_extra_info_necessary(word, all_words):
+        if hasExtraInfo and not is_extra_info_necessary(word, english_words_by_tolkienian):
             word["extra_info"] = None
 
-def remove_duplications(all_words):
+def duplication_keys(word):
+    keys = []
+    if word.get("tolkienian_word") is not None:
+        keys.append(("tolkienian_word", word.get("tolkienian_word")))
+    if word.get("english_word") is not None:
+        english_word = word.get("english_word")
+        for marker in UNCERTAINTY_MARKERS:
+            english_word = english_word.replace(marker, "")
+        keys.append(("english_word", english_word, word.get("part_of_speech")))
+    return keys
+
+def find_duplication_components(all_words):
+    """
+    Groups the words into connected components of words sharing a Tolkienian or an English duplication key.
+    Words in different components can never be duplicates of each other.
+    """
+    parents = list(range(len(all_words)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    first_index_by_key = {}
+    for index, word in enumerate(all_words):
+        for key in duplication_keys(word):
+            other_index = first_index_by_key.setdefault(key, index)
+            root, other_root = find(index), find(other_index)
+            if root != other_root:
+                parents[max(root, other_root)] = min(root, other_root)
+
+    components = {}
+    for index in range(len(all_words)):
+        components.setdefault(find(index), []).append(index)
+    return list(components.values())
+
+def remove_duplications_in_place(all_words, touched_keys=None):
     for word in all_words:
         if word.get("tolkienian_word") is None:
             continue
@@ -575,7 +1077,62 @@ def remove_duplications(all_words):
         english_duplicates = find_english_duplicates(all_words, word)
         if len(english_duplicates) > 1:
             merge_duplicates(english_duplicates, "tolkienian_word")
-    all_words = [word for word in all_words if word.get("tolkienian_word") is not None]
+        if touched_keys is not None:
+            for duplicate in tolkienian_duplicates + english_duplicates:
+                touched_keys.update(duplication_keys(duplicate))
+
+def remove_duplications_in_components(components):
+    results = []
+    for words in components:
+        touched_keys = set()
+        for word in words:
+            touched_keys.update(duplication_keys(word))
+        remove_duplications_in_place(words, touched_keys)
+        results.append((words, touched_keys))
+    return results
+
+def split_into_batches(components, number_of_batches):
+    batches = [[] for _ in range(number_of_batches)]
+    sizes = [0] * number_of_batches
+    for component in sorted(components, key=len, reverse=True):
+        smallest = sizes.index(min(sizes))
+        batches[smallest].append(component)
+        sizes[smallest] += len(component)
+    return [batch for batch in batches if batch]
+
+def remove_duplications_sharded(all_words, workers):
+    components = find_duplication_components(all_words)
+    if workers > 1 and len(components) > 1:
+        batches = split_into_batches(components, workers * 4)
+        import concurrent.futures
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            batch_results = executor.map(remove_duplications_in_components, [[[all_words[index] for index in component] for component in batch] for batch in batches])
+            results = [result for batch_result in batch_results for result in batch_result]
+        components = [component for batch in batches for component in batch]
+    else:
+        results = remove_duplications_in_components([[all_words[index] for index in component] for component in components])
+
+    component_by_key = {}
+    deduplicated = [None] * len(all_words)
+    for component_index, (component, (words, touched_keys)) in enumerate(zip(components, results)):
+        for key in touched_keys:
+            if component_by_key.setdefault(key, component_index) != component_index:
+                return None
+        for index, word in zip(component, words):
+            deduplicated[index] = word
+    return deduplicated
+
+def remove_duplications(all_words, workers=1):
+    """
+    Deduplication runs independently per connected component of possible duplicates, optionally in a process pool.
+    Merging may create new values that connect two components, in which case the global algorithm is used instead.
+    """
+    original_words = [word.copy() for word in all_words]
+    deduplicated = remove_duplications_sharded(all_words, workers)
+    if deduplicated is None:
+        deduplicated = original_words
+        remove_duplications_in_place(deduplicated)
+    all_words = [word for word in deduplicated if word.get("tolkienian_word") is not None]
     remove_unnecessary_extra_info(all_words)
     return all_words
 
@@ -596,29 +1153,103 @@ def format_word(word):
     
     return formatted_word
 
-def format_words(words):
+def elvish_sort_key(formatted_word):
+    """
+    Compares the Tolkienian side by its base letters first, ignoring diacritics, case and punctuation.
+    Ties are broken by the codepoints of the whole card, so the order is the same on every platform.
+    """
+    import unicodedata
+    front = formatted_word.split(DELIMITER, 1)[0]
+    decomposed = unicodedata.normalize("NFD", front.casefold())
+    letters = "".join(ELVISH_LETTERS.get(character, character) for character in decomposed if character.isalnum())
+    return (letters, formatted_word)
+
+def format_words(words, sort_order="codepoint"):
     formatted_words = []
     for word in words:
         formatted_word = format_word(word)
         if formatted_word is not None:
             formatted_words.append(formatted_word)
-    formatted_words.sort()
+    if sort_order == "elvish":
+        formatted_words.sort(key=elvish_sort_key)
+    else:
+        formatted_words.sort()
     return formatted_words
 
-def write_to_file(args, languages, words):
+def write_file_atomically(filename, content):
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            if hashlib.sha256(f.read()).digest() == hashlib.sha256(content).digest():
+                return False
+        mode = os.stat(filename).st_mode & 0o777
+    else:
+        mode = 0o644
+
+    dir_name = os.path.dirname(filename) or "."
+    import tempfile
+    fd, temp_file = tempfile.mkstemp(dir=dir_name, prefix="." + os.path.basename(filename) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_file, mode)
+        os.replace(temp_file, filename)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    return True
+
+def get_deck_name(args, languages):
     language_name = languages[0].get("name")
     if args.neo:
         language_name = "Neo-" + language_name
-    output_dir = "output"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    filename = output_dir + "/" + language_name + ".txt"
+    return language_name
 
-    with open(filename, 'w') as f:
-        for word in words:
-            f.write(word)
-    
-    print("Written output to ", filename)
+def get_output_file(args, languages):
+    return os.path.join(OUTPUT_DIR, get_deck_name(args, languages) + ".txt")
+
+def write_to_file(args, languages, words):
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+    filename = get_output_file(args, languages)
+
+    content = "".join(words).encode("utf-8")
+    if write_file_atomically(filename, content):
+        print("Written output to ", filename)
+    else:
+        print("Output ", filename, " is already up to date")
+    if args.gzip:
+        import gzip
+        write_file_atomically(filename + ".gz", gzip.compress(content, mtime=0))
+
+def check_output(args, languages, words):
+    """
+    Compares the generated cards with the output file, without writing anything.
+    Returns whether the output file is up to date.
+    """
+    filename = get_output_file(args, languages)
+    content = "".join(words).encode("utf-8")
+    existing_content = b""
+    if os.path.exists(filename):
+        with open(filename, 'rb') as f:
+            existing_content = f.read()
+    if hashlib.sha256(existing_content).digest() == hashlib.sha256(content).digest():
+        print("Output ", filename, " is up to date")
+        return True
+
+    existing_cards = collections.Counter(existing_content.decode("utf-8").splitlines())
+    cards = collections.Counter(word.rstrip("\n") for word in words)
+    added = sorted((cards - existing_cards).elements())
+    removed = sorted((existing_cards - cards).elements())
+    print(f"Output {filename} is outdated: {len(added)} cards added, {len(removed)} cards removed")
+    if args.verbose:
+        for card in removed:
+            print(f"- {card}")
+        for card in added:
+            print(f"+ {card}")
+    return False
 
 def print_parts_of_speech(filtered_words):
     included_speech_values = [word.get('speech') for word in filtered_words]
@@ -626,11 +1257,13 @@ def print_parts_of_speech(filtered_words):
     included_speech_values.sort()
     print("Collected cards of the following part of speech types:\n", included_speech_values)
 
-def is_deprecated(word, all_words, referenced_words=[]):
+def is_deprecated(word, all_words, referenced_words=None):
     """
     This is the relevant part for the logic:
     https://github.com/pfstrack/eldamo/blob/master/src/main/webapp/config/query-configs/root-index.xq
     """
+    if referenced_words is None:
+        referenced_words = []
     if word.find('deprecated') is not None:
         return True
     if word.get('mark') == "|":
@@ -660,45 +1293,573 @@ def is_deprecated(word, all_words, referenced_words=[]):
 def is_archaic(word):
     return word.get('mark') == "†"
 
-def filtered_words(args, language_ids, speech_types_to_exclude, words):
+def filtered_words(args, language_ids, speech_types_to_exclude, words, metrics=None):
     filtered = [word for word in words if word.get('l') in language_ids]
+    counts = {}
     if args.neo and not args.include_deprecated:
+        counts["deprecated"] = len(filtered)
         filtered = [word for word in filtered if not is_deprecated(word, filtered, [])]
+        counts["deprecated"] -= len(filtered)
     if not args.include_archaic:
+        counts["archaic"] = len(filtered)
         filtered = [word for word in filtered if not is_archaic(word)]
+        counts["archaic"] -= len(filtered)
+    counts["speech"] = len(filtered)
     filtered = [word for word in filtered if word.get('speech') not in speech_types_to_exclude]
+    counts["speech"] -= len(filtered)
+    if metrics is not None:
+        for reason, number in counts.items():
+            metrics["filtered_out"][reason] += number
     return filtered
 
-def main(args):
+def read_categories(root):
+    categoriy_entries = root.findall(".//cat-group")
+    return [{ "id": cat.get("id"), "label": cat.get("label") }  for cat in categoriy_entries]
+
+def generate_word_maps(args, words, categories, base_maps=None, metrics=None, card_sets=None):
+    """
+    Filters, maps and deduplicates the words of a deck. Returns the cards as word maps.
+    """
     languages = get_languages_to_generate(args)
-    print("Generating cards for the following languages: ", [lang.get("name") for lang in languages])
     language_ids = [lang.get("id") for lang in languages]
     speech_types_to_exclude = get_speech_types_to_exclude(args)
 
-    ensure_endamo_data(args)
-    root = read_endamo_data()
-    if root is not None:
-        categoriy_entries = root.findall(".//cat-group")
-        categories = [{ "id": cat.get("id"), "label": cat.get("label") }  for cat in categoriy_entries]
+    start = time.perf_counter()
+    filtered = filtered_words(args, language_ids, speech_types_to_exclude, words, metrics)
+    start = record_stage_duration(metrics, "filter", start)
 
-        words = root.findall(".//word")
-        
-        filtered = filtered_words(args, language_ids, speech_types_to_exclude, words)
-        
-        if args.verbose:
-            print_parts_of_speech(filtered)
+    if args.verbose:
+        print_parts_of_speech(filtered)
 
-        word_maps = words_to_maps(filtered, categories, args)
+    word_maps = words_to_maps(filtered, categories, args, base_maps, metrics, card_sets)
+    start = record_stage_duration(metrics, "map", start)
 
-        word_maps = remove_duplications(word_maps)
-        if args.verbose:
-            print("Collected ", len(word_maps), " cards")
+    number_of_maps = len(word_maps)
+    word_maps = remove_duplications(word_maps, args.dedup_workers)
+    record_stage_duration(metrics, "dedup", start)
+    if metrics is not None:
+        metrics["duplicates_merged"] += number_of_maps - len(word_maps)
+    if args.verbose:
+        print("Collected ", len(word_maps), " cards")
+    return word_maps
+
+def format_cards(args, word_maps, metrics=None):
+    start = time.perf_counter()
+    formatted_words = format_words(word_maps, args.sort_order)
+    record_stage_duration(metrics, "format", start)
+    return formatted_words
+
+def record_card_history(args, word_maps):
+    if args.card_history is None or args.check:
+        return
+    import card_history
+    deck = get_deck_name(args, get_languages_to_generate(args))
+    run = card_history.update_card_history(args.card_history, deck, word_maps)
+    print("Recorded the cards of ", deck, " as run ", run, " in ", args.card_history)
+
+def new_metrics():
+    return {
+        "cards": 0,
+        "filtered_out": {reason: 0 for reason in FILTER_REASONS},
+        "duplicates_merged": 0,
+        "stage_seconds": {},
+        "cache": {},
+    }
+
+def record_stage_duration(metrics, stage, start):
+    """
+    Adds the time since start to the duration of the stage and returns the current time as the start of the next stage.
+    """
+    now = time.perf_counter()
+    if metrics is not None:
+        metrics["stage_seconds"][stage] = metrics["stage_seconds"].get(stage, 0.0) + now - start
+    return now
+
+def count_cache_usage(metrics, cache, hits, misses):
+    usage = metrics["cache"].setdefault(cache, {"hits": 0, "misses": 0})
+    usage["hits"] += hits
+    usage["misses"] += misses
+
+def metrics_to_samples(deck, metrics):
+    samples = [
+        ("eldamo_deck_cards", {"deck": deck}, metrics["cards"]),
+        ("eldamo_duplicates_merged", {"deck": deck}, metrics["duplicates_merged"]),
+        ("eldamo_last_run_timestamp_seconds", {"deck": deck}, metrics["timestamp"]),
+    ]
+    for reason, number in metrics["filtered_out"].items():
+        samples.append(("eldamo_words_filtered_out", {"deck": deck, "reason": reason}, number))
+    for stage, seconds in metrics["stage_seconds"].items():
+        samples.append(("eldamo_stage_duration_seconds", {"deck": deck, "stage": stage}, seconds))
+    for cache, usage in metrics["cache"].items():
+        samples.append(("eldamo_cache_hits", {"deck": deck, "cache": cache}, usage["hits"]))
+        samples.append(("eldamo_cache_misses", {"deck": deck, "cache": cache}, usage["misses"]))
+    return samples
+
+def format_sample(name, labels, value):
+    label_string = ",".join(f'{key}="{label}"' for key, label in labels.items())
+    return f"{name}{{{label_string}}} {value}"
+
+def format_prometheus_metrics(existing_content, deck, metrics):
+    """
+    Replaces the samples of the deck in a Prometheus textfile, keeping the samples of all other decks.
+    """
+    deck_label = f'deck="{deck}"'
+    lines_by_name = {}
+    for line in existing_content.splitlines():
+        if not line or line.startswith("#") or deck_label in line:
+            continue
+        name = get_regex(r"[{ ]").split(line, maxsplit=1)[0]
+        lines_by_name.setdefault(name, []).append(line)
+    for name, labels, value in metrics_to_samples(deck, metrics):
+        lines_by_name.setdefault(name, []).append(format_sample(name, labels, value))
+
+    lines = []
+    for name in sorted(lines_by_name):
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(sorted(lines_by_name[name]))
+    return "\n".join(lines) + "\n"
+
+def write_metrics(args, deck, metrics):
+    """
+    Every deck is generated by its own run, so each run only replaces the entry of its deck in the metrics file.
+    Runs in parallel processes take turns, so that none of their entries get lost.
+    """
+    metrics["timestamp"] = int(time.time())
+    with file_lock(args.metrics_file):
+        existing_content = ""
+        if os.path.exists(args.metrics_file):
+            with open(args.metrics_file, 'r', encoding="utf-8") as f:
+                existing_content = f.read()
+        if args.metrics_format == "prometheus":
+            content = format_prometheus_metrics(existing_content, deck, metrics)
+        else:
+            all_metrics = json.loads(existing_content) if existing_content else {}
+            all_metrics[deck] = metrics
+            content = json.dumps(all_metrics, ensure_ascii=False, indent=2, sort_keys=True) + "\n"
+        write_file_atomically(args.metrics_file, content.encode("utf-8"))
+
+class EldamoDatabase:
+    """
+    The parsed Eldamo data, indexed by language.
+    The parsed words are read-only, so the database can be shared between threads and used for any number of decks.
+    Only the base_maps cache is filled on first use. That is not synchronized, so threads may compute the same base map twice, but they all get equal ones.
+    """
+    def __init__(self, words, categories):
+        self.categories = categories
+        self.words = words
+        self.base_maps = {}
+        self.positions_by_language = {}
+        for position, word in enumerate(self.words):
+            self.positions_by_language.setdefault(word.get('l'), []).append(position)
+
+    @classmethod
+    def from_root(cls, root):
+        return cls(root.findall(".//word"), read_categories(root))
+
+    @classmethod
+    def from_file(cls, filename=INPUT_FILE, backend="auto"):
+        data = read_endamo_data(filename, backend)
+        if data is None:
+            raise ValueError(f"File {filename} not found.")
+        words, categories = data
+        return cls(words, categories)
+
+    def words_for_languages(self, language_ids):
+        position_lists = [self.positions_by_language.get(language_id, []) for language_id in language_ids]
+        return [self.words[position] for position in heapq.merge(*position_lists)]
+
+def read_overlay(filename):
+    """
+    Reads the words of an overlay file.
+    XML overlays contain <word> elements like the Eldamo data, which need no common root element.
+    CSV overlays have a header of word attributes, and see and deprecated columns referencing a word as <l>:<v>.
+    """
+    if filename.lower().endswith(".csv"):
+        import csv
+        words = []
+        with open(filename, 'r', encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                attributes = {key: value for key, value in row.items() if key is not None and key not in WORD_LINK_TAGS and value}
+                links = []
+                for tag in WORD_LINK_TAGS:
+                    if row.get(tag):
+                        language, _, value = row[tag].partition(":")
+                        links.append([tag, {"l": language, "v": value}])
+                words.append(record_to_word({"attributes": attributes, "links": links}))
+        return words
+    with open(filename, 'r', encoding="utf-8") as f:
+        content = get_regex(XML_DECLARATION).sub("", f.read(), count=1)
+    return list(ElementTree.fromstring(f"<overlay>{content}</overlay>").iter("word"))
+
+def merge_overlay_word(word, overlay_word):
+    """
+    The overlay replaces the attributes it sets, and the links if it has any.
+    """
+    record = word_to_record(word)
+    overlay_record = word_to_record(overlay_word)
+    record["attributes"].update(overlay_record["attributes"])
+    if overlay_record["links"]:
+        record["links"] = overlay_record["links"]
+    return record_to_word(record)
+
+class OverlayDatabase:
+    """
+    A database with overlay words merged in by their value and language.
+    Overlay words without a counterpart are added after the words of their language.
+    The base database is not modified, so it can stay loaded while the overlays change.
+    Merged words are created on first use without a lock. setdefault makes sure that all threads use the first one stored.
+    """
+    def __init__(self, db, overlay_words):
+        self.db = db
+        self.categories = db.categories
+        self.base_maps = None if db.base_maps is None else {}
+        self.overlay_words = {}
+        for overlay_word in overlay_words:
+            key = (overlay_word.get("v"), overlay_word.get("l"))
+            if key in self.overlay_words:
+                overlay_word = merge_overlay_word(self.overlay_words[key], overlay_word)
+            self.overlay_words[key] = overlay_word
+        self.merged_words = {}
+
+    def merged_word(self, word, overlay_word):
+        if self.base_maps is None:
+            return merge_overlay_word(word, overlay_word)
+        # Merged words are kept together with their base word, so that their ids stay valid keys of the base maps.
+        merged = self.merged_words.get(id(word))
+        if merged is None:
+            merged = self.merged_words.setdefault(id(word), (word, merge_overlay_word(word, overlay_word)))
+        return merged[1]
+
+    def words_for_languages(self, language_ids):
+        words = []
+        keys = set()
+        for word in self.db.words_for_languages(language_ids):
+            key = (word.get("v"), word.get("l"))
+            keys.add(key)
+            overlay_word = self.overlay_words.get(key)
+            words.append(word if overlay_word is None else self.merged_word(word, overlay_word))
+        for key, overlay_word in self.overlay_words.items():
+            if key[1] in language_ids and key not in keys:
+                words.append(overlay_word)
+        return words
+
+def apply_overlays(db, overlays):
+    if not overlays:
+        return db
+    return OverlayDatabase(db, [word for overlay in overlays for word in read_overlay(overlay)])
+
+def deck_options(language, **flags):
+    options = SimpleNamespace(language=language, **RUN_OPTIONS)
+    for option in DECK_OPTIONS:
+        setattr(options, option, False)
+    for option, value in flags.items():
+        if option not in DECK_OPTIONS and option not in RUN_OPTIONS:
+            raise ValueError(f"Unknown deck option: {option}")
+        setattr(options, option, value)
+    return options
+
+def generate_deck_maps(db, options, metrics=None, card_sets=None):
+    languages = get_languages_to_generate(options)
+    words = db.words_for_languages([lang.get("id") for lang in languages])
+    if db.base_maps is None:
+        # The words are created anew for every query, so their ids cannot key a cache.
+        card_sets = None
+    return generate_word_maps(options, words, db.categories, db.base_maps, metrics, card_sets)
+
+def generate_deck(db, options, metrics=None, card_sets=None):
+    """
+    Returns the formatted cards of a deck, without writing anything.
+    """
+    return format_cards(options, generate_deck_maps(db, options, metrics, card_sets), metrics)
+
+def load_database(args):
+    if args.input_database is not None:
+        import eldamo_sqlite
+        return apply_overlays(eldamo_sqlite.open_eldamo_database(args.input_database), args.overlays)
+    data = load_endamo_data(args)
+    if data is None:
+        raise ValueError("Could not read Eldamo data")
+    words, categories = data
+    return apply_overlays(EldamoDatabase(words, categories), args.overlays)
 
-        formatted_words = format_words(word_maps)
+def file_hash(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def language_fingerprints(db):
+    """
+    Hashes the word records of every language in order, together with the categories and the words of other languages they reference.
+    """
+    records_by_language = {}
+    records_by_key = {}
+    for language in SUPPORTED_LANGUAGES:
+        records = [word_to_record(word) for word in db.words_for_languages([language["id"]])]
+        records_by_language[language["id"]] = records
+        for record in records:
+            records_by_key.setdefault((record["attributes"].get("v"), record["attributes"].get("l")), record)
+
+    fingerprints = {}
+    for language_id, records in records_by_language.items():
+        referenced_records = [[records_by_key.get((attributes.get("v"), attributes.get("l"))) for _, attributes in record["links"] if attributes.get("l") != language_id] for record in records]
+        content = json.dumps([db.categories, records, referenced_records], ensure_ascii=False, sort_keys=True)
+        fingerprints[language_id] = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return fingerprints
+
+def code_hashes(args):
+    """
+    Hashes the modules the cards are generated with: generate.py, and eldamo_sqlite.py when the words are read from a database.
+    """
+    modules = [os.path.abspath(__file__)]
+    if args.input_database is not None:
+        modules.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "eldamo_sqlite.py"))
+    return [file_hash(module) for module in modules]
+
+def deck_fingerprint(args, languages, fingerprints):
+    """
+    The fingerprints of the languages of the deck, and a hash of everything else its cards depend on: the generator and the options.
+    """
+    options = {option: getattr(args, option) for option in DECK_OPTIONS + ["sort_order"]}
+    settings = json.dumps([code_hashes(args), options], sort_keys=True)
+    return {
+        "languages": {lang.get("id"): fingerprints[lang.get("id")] for lang in languages},
+        "settings": hashlib.sha256(settings.encode("utf-8")).hexdigest(),
+    }
+
+def read_fingerprints():
+    if not os.path.exists(FINGERPRINT_FILE):
+        return {}
+    with open(FINGERPRINT_FILE, 'r', encoding="utf-8") as f:
+        return json.load(f)
+
+def is_deck_up_to_date(args, languages, fingerprint, stored_fingerprints):
+    """
+    The output file also has to be unchanged since the deck was generated, as other runs may have overwritten it.
+    """
+    output_file = get_output_file(args, languages)
+    if not os.path.exists(output_file):
+        return False
+    stored_fingerprint = stored_fingerprints.get(get_deck_name(args, languages))
+    return stored_fingerprint == dict(fingerprint, output=file_hash(output_file))
 
+def write_deck_fingerprint(args, languages, fingerprint, stored_fingerprints):
+    """
+    Stores the fingerprint of a freshly written deck, with the hash of its output file.
+    """
+    stored_fingerprints[get_deck_name(args, languages)] = dict(fingerprint, output=file_hash(get_output_file(args, languages)))
+    content = json.dumps(stored_fingerprints, indent=2, sort_keys=True) + "\n"
+    dir_name = os.path.dirname(FINGERPRINT_FILE)
+    if dir_name and not os.path.exists(dir_name):
+        os.makedirs(dir_name, exist_ok=True)
+    write_file_atomically(FINGERPRINT_FILE, content.encode("utf-8"))
+
+def get_input_hash(args, input_file):
+    input_hash = file_hash(input_file)
+    if not args.overlays:
+        return input_hash
+    overlay_hashes = [file_hash(overlay) for overlay in args.overlays]
+    return hashlib.sha256(json.dumps([input_hash] + overlay_hashes).encode("utf-8")).hexdigest()
+
+def word_to_record(word):
+    links = [[child.tag, dict(child.attrib)] for child in word if child.tag in WORD_LINK_TAGS]
+    return {"attributes": dict(word.attrib), "links": links}
+
+def record_to_word(record):
+    word = ElementTree.Element("word", record["attributes"])
+    for tag, attributes in record["links"]:
+        ElementTree.SubElement(word, tag, attributes)
+    return word
+
+def checkpoint_file(args, stage, input_hash):
+    language_ids = [lang.get("id") for lang in get_languages_to_generate(args)]
+    options = {option: getattr(args, option) for option in STAGE_OPTIONS[stage]}
+    key = json.dumps([input_hash, code_hashes(args), stage, language_ids, options], sort_keys=True)
+    key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CHECKPOINT_DIR, f"{language_ids[0]}-{stage}-{key_hash}.json")
+
+def read_checkpoint(args, stage, input_hash):
+    filename = checkpoint_file(args, stage, input_hash)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'r', encoding="utf-8") as f:
+        data = json.load(f)
+    if stage == "filter":
+        data["words"] = [record_to_word(record) for record in data["words"]]
+    return data
+
+def write_checkpoint(args, stage, input_hash, data):
+    if stage == "filter":
+        data = {"categories": data["categories"], "words": [word_to_record(word) for word in data["words"]]}
+    if not os.path.exists(CHECKPOINT_DIR):
+        os.makedirs(CHECKPOINT_DIR)
+    content = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    filename = checkpoint_file(args, stage, input_hash)
+    write_file_atomically(filename, content)
+    remove_older_checkpoints(filename)
+
+def remove_older_checkpoints(filename):
+    """
+    Only the latest checkpoint of a language and stage is kept, the others were made with other input, code or options.
+    """
+    prefix = os.path.basename(filename).rsplit("-", 1)[0] + "-"
+    for other in os.listdir(CHECKPOINT_DIR):
+        if other.startswith(prefix) and other.endswith(".json") and other != os.path.basename(filename):
+            os.remove(os.path.join(CHECKPOINT_DIR, other))
+
+def generate_cards_with_checkpoints(args, input_file, load, metrics=None):
+    """
+    Runs the stages of generate_word_maps and format_cards, storing the result of every stage as a checkpoint.
+    With --from-stage, the nearest valid checkpoint before that stage is loaded instead of running the earlier stages.
+    Checkpoints are only valid for the same input file, overlays, code (see code_hashes) and the options that affect their stage.
+    """
+    input_hash = get_input_hash(args, input_file)
+    first_stage = 0
+    data = None
+    if args.from_stage is not None:
+        for stage_index in range(STAGES.index(args.from_stage), 0, -1):
+            data = read_checkpoint(args, STAGES[stage_index - 1], input_hash)
+            if data is not None:
+                first_stage = stage_index
+                print("Resuming from the checkpoint before stage ", STAGES[stage_index])
+                break
+        if metrics is not None:
+            count_cache_usage(metrics, "checkpoints", int(data is not None), int(data is None))
+
+    for stage in STAGES[first_stage:]:
+        if stage == "filter":
+            db = load()
+            languages = get_languages_to_generate(args)
+            words = db.words_for_languages([lang.get("id") for lang in languages])
+            start = time.perf_counter()
+            filtered = filtered_words(args, [lang.get("id") for lang in languages], get_speech_types_to_exclude(args), words, metrics)
+            record_stage_duration(metrics, stage, start)
+            if args.verbose:
+                print_parts_of_speech(filtered)
+            data = {"categories": db.categories, "words": filtered}
+        elif stage == "map":
+            start = time.perf_counter()
+            data = words_to_maps(data["words"], data["categories"], args, None, metrics)
+            record_stage_duration(metrics, stage, start)
+        elif stage == "dedup":
+            start = time.perf_counter()
+            number_of_maps = len(data)
+            data = remove_duplications(data, args.dedup_workers)
+            record_stage_duration(metrics, stage, start)
+            if metrics is not None:
+                metrics["duplicates_merged"] += number_of_maps - len(data)
+            if args.verbose:
+                print("Collected ", len(data), " cards")
+        elif stage == "format":
+            formatted_words = format_cards(args, data, metrics)
+            record_card_history(args, data)
+            return formatted_words
+        write_checkpoint(args, stage, input_hash, data)
+
+def get_batch_args(args):
+    """
+    Every deck of the batch gets its own copy of the arguments.
+    Only the first one may re-download the Eldamo data.
+    """
+    batch_args = []
+    for index, (language, neo) in enumerate(ALL_DECKS):
+        deck_args = copy.copy(args)
+        deck_args.language = language
+        deck_args.neo = neo
+        deck_args.check_for_updates = args.check_for_updates and index == 0
+        batch_args.append(deck_args)
+    return batch_args
+
+def generate_and_write(args, load, card_sets=None):
+    """
+    Generates one deck and writes it, or only compares it with the output file if args.check is set.
+    Returns whether the output file was up to date.
+    """
+    languages = get_languages_to_generate(args)
+    print("Generating cards for the following languages: ", [lang.get("name") for lang in languages])
+
+    metrics = new_metrics() if args.metrics_file is not None else None
+    if metrics is not None and args.input_database is None:
+        is_downloaded = needs_download(args)
+        count_cache_usage(metrics, "input", int(not is_downloaded), int(is_downloaded))
+
+    def load_with_metrics():
+        start = time.perf_counter()
+        db = load(args)
+        record_stage_duration(metrics, "load", start)
+        return db
+
+    if args.checkpoints or args.from_stage is not None:
+        if args.input_database is not None:
+            input_file = args.input_database
+        else:
+            ensure_endamo_data(args)
+            input_file = INPUT_FILE
+        formatted_words = generate_cards_with_checkpoints(args, input_file, load_with_metrics, metrics)
+    else:
+        word_maps = generate_deck_maps(load_with_metrics(), args, metrics, card_sets)
+        formatted_words = format_cards(args, word_maps, metrics)
+        record_card_history(args, word_maps)
+
+    is_up_to_date = True
+    if args.check:
+        is_up_to_date = check_output(args, languages, formatted_words)
+    else:
         write_to_file(args, languages, formatted_words)
+    if metrics is not None:
+        metrics["cards"] = len(formatted_words)
+        write_metrics(args, get_deck_name(args, languages), metrics)
+    return is_up_to_date
+
+def main(args):
+    is_batch = args.language.lower() == BATCH_LANGUAGE
+    if is_batch:
+        all_args = get_batch_args(args)
     else:
-        raise ValueError("Could not read Eldamo data")
+        all_args = [args]
+
+    # The Eldamo data is loaded at most once, however many decks are generated.
+    databases = []
+    def load(deck_args):
+        if not databases:
+            databases.append(load_database(deck_args))
+        return databases[0]
+
+    # The cards of languages in several decks are cached, see words_to_maps.
+    decks_per_language = collections.Counter(lang.get("id") for deck_args in all_args for lang in get_languages_to_generate(deck_args))
+    card_sets = {language_id: {} for language_id, number_of_decks in decks_per_language.items() if number_of_decks > 1}
+
+    # A batch only writes the decks whose languages, options or output files changed since the last batch.
+    # Decks are never skipped if they also have to be compressed, recorded or measured.
+    can_skip = is_batch and not args.check and not any(getattr(args, option) for option in SIDE_EFFECT_OPTIONS)
+    fingerprints = None
+    stored_fingerprints = {}
+
+    outdated_decks = []
+    for index, deck_args in enumerate(all_args):
+        if index > 0:
+            print()
+        languages = get_languages_to_generate(deck_args)
+        fingerprint = None
+        if can_skip:
+            if fingerprints is None:
+                fingerprints = language_fingerprints(load(deck_args))
+                stored_fingerprints = read_fingerprints()
+            fingerprint = deck_fingerprint(deck_args, languages, fingerprints)
+            if is_deck_up_to_date(deck_args, languages, fingerprint, stored_fingerprints):
+                print(f"Skipping {get_deck_name(deck_args, languages)}, its languages did not change.")
+                continue
+        if not generate_and_write(deck_args, load, card_sets):
+            outdated_decks.append(get_deck_name(deck_args, languages))
+        if fingerprint is not None:
+            write_deck_fingerprint(deck_args, languages, fingerprint, stored_fingerprints)
+
+    if outdated_decks:
+        print()
+        print("The following decks are outdated: ", ", ".join(outdated_decks))
+        print("Please run ./generate_all.sh and commit the changes.")
+        sys.exit(1)
 
 if __name__ == "__main__":
     args = parse_args()
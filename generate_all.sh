@@ -1,31 +1,31 @@
 #!/bin/bash
 
-python3 generate.py Adunaic
+python3 generate.py Adunaic "$@"
 echo
-python3 generate.py Black-Speech
+python3 generate.py Black-Speech "$@"
 echo
-python3 generate.py Early-Noldorin
+python3 generate.py Early-Noldorin "$@"
 echo
-python3 generate.py Early-Quenya
+python3 generate.py Early-Quenya "$@"
 echo
-python3 generate.py Gnomish
+python3 generate.py Gnomish "$@"
 echo
-python3 generate.py Khuzdul
+python3 generate.py Khuzdul "$@"
 echo
-python3 generate.py Noldorin
+python3 generate.py Noldorin "$@"
 echo
-python3 generate.py Primitive
+python3 generate.py Primitive "$@"
 echo
-python3 generate.py Primitive --neo
+python3 generate.py Primitive --neo "$@"
 echo
-python3 generate.py Middle-Quenya
+python3 generate.py Middle-Quenya "$@"
 echo
-python3 generate.py Quenya
+python3 generate.py Quenya "$@"
 echo
-python3 generate.py Quenya --neo
+python3 generate.py Quenya --neo "$@"
 echo
-python3 generate.py Sindarin
+python3 generate.py Sindarin "$@"
 echo
-python3 generate.py Sindarin --neo
+python3 generate.py Sindarin --neo "$@"
 echo
-python3 generate.py Telerin
+python3 generate.py Telerin "$@"
@@ -0,0 +1,142 @@
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+
+OUTPUT_DIRECTORY = "output/"
+ANKI_EXPORT_DIRECTORY = "anki_exports/"
+UPDATE_INSTRUCTIONS_DIRECTORY = "update_instructions/"
+MISSING_GUID = "?"
+HEADER = "The following outdated cards need to be deleted manually:"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Write the update instructions for a deck by comparing two versions of its output file.')
+    parser.add_argument('deck', type=str, help='Name of the deck, e.g. Neo-Quenya')
+    parser.add_argument('--old', type=str, default=None, help='Previous version of the output file; defaults to the committed one')
+    parser.add_argument('--new', type=str, default=None, help='New version of the output file; defaults to the one in output/')
+    parser.add_argument('--anki-export', type=str, default=None, help='Anki export with the GUIDs of the previous version; defaults to the one in anki_exports/')
+    parser.add_argument('--date', type=str, default=None, help='Date of the release as YY-MM-DD; defaults to today')
+
+    return parser.parse_args()
+
+def parse_cards(lines):
+    cards = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            front, back = line.split("|")
+            cards.append((front, back))
+    return cards
+
+def read_cards(filename):
+    with open(filename, "r", encoding="utf-8") as f:
+        return parse_cards(f)
+
+def read_committed_cards(deck):
+    path = OUTPUT_DIRECTORY + deck + ".txt"
+    content = subprocess.run(["git", "show", f"HEAD:{path}"], check=True, capture_output=True).stdout
+    return parse_cards(content.decode("utf-8").splitlines())
+
+def read_guids(filename):
+    guids = {}
+    with open(filename, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            guid, front, back = line.strip().split("\t")[:3]
+            guids.setdefault((front, back), guid)
+    return guids
+
+def merge_on(old_cards, new_cards, key_index):
+    """
+    Pairs cards with the same front (key_index 0) or back (key_index 1) by walking both lists in sorted order.
+    Returns the pairs and the unpaired old and new cards.
+    """
+    old_sorted = sorted(old_cards, key=lambda card: (card[key_index], card))
+    new_sorted = sorted(new_cards, key=lambda card: (card[key_index], card))
+    pairs = []
+    old_unpaired = []
+    new_unpaired = []
+    i = 0
+    j = 0
+    while i < len(old_sorted) and j < len(new_sorted):
+        old_key = old_sorted[i][key_index]
+        new_key = new_sorted[j][key_index]
+        if old_key == new_key:
+            pairs.append((old_sorted[i], new_sorted[j]))
+            i += 1
+            j += 1
+        elif old_key < new_key:
+            old_unpaired.append(old_sorted[i])
+            i += 1
+        else:
+            new_unpaired.append(new_sorted[j])
+            j += 1
+    old_unpaired.extend(old_sorted[i:])
+    new_unpaired.extend(new_sorted[j:])
+    return pairs, old_unpaired, new_unpaired
+
+def diff_cards(old_cards, new_cards):
+    """
+    Classifies the changes between two versions of a deck in O(N log N).
+    Like update_update_file.py, a card keeps its identity if either its front or its back stays the same.
+    """
+    same_front, old_rest, new_rest = merge_on(old_cards, new_cards, 0)
+    front_changed, removed, added = merge_on(old_rest, new_rest, 1)
+    back_changed = [(old, new) for old, new in same_front if old[1] != new[1]]
+    return {
+        "added": added,
+        "removed": removed,
+        "front_changed": front_changed,
+        "back_changed": back_changed,
+    }
+
+def format_instructions(removed, guids):
+    lines = [HEADER]
+    for front, back in removed:
+        guid = guids.get((front, back), MISSING_GUID)
+        lines.append(f"{guid} | {front} | {back}")
+    return "\n".join(lines) + "\n"
+
+def order_like_export(cards, guids):
+    positions = {card: position for position, card in enumerate(guids)}
+    return sorted(cards, key=lambda card: (positions.get(card, len(positions)), card))
+
+def main(args):
+    deck = args.deck[:-len(".txt")] if args.deck.endswith(".txt") else args.deck
+    new_file = args.new if args.new is not None else OUTPUT_DIRECTORY + deck + ".txt"
+    anki_export = args.anki_export if args.anki_export is not None else ANKI_EXPORT_DIRECTORY + deck + ".txt"
+    date = args.date if args.date is not None else datetime.date.today().strftime("%y-%m-%d")
+
+    old_cards = read_cards(args.old) if args.old is not None else read_committed_cards(deck)
+    new_cards = read_cards(new_file)
+    diff = diff_cards(old_cards, new_cards)
+
+    print("Added cards:         ", len(diff["added"]))
+    print("Removed cards:       ", len(diff["removed"]))
+    print("Cards with new front:", len(diff["front_changed"]))
+    print("Cards with new back: ", len(diff["back_changed"]))
+
+    if len(diff["removed"]) == 0:
+        print("No cards need to be deleted, so no update instructions are needed.")
+        return
+
+    guids = read_guids(anki_export) if os.path.exists(anki_export) else {}
+    removed = order_like_export(diff["removed"], guids)
+    missing = [card for card in removed if card not in guids]
+    if len(missing) > 0:
+        print("Warning: ", len(missing), " removed cards were not found in ", anki_export, ", their GUID is written as ", MISSING_GUID)
+
+    filename = os.path.join(UPDATE_INSTRUCTIONS_DIRECTORY, f"{deck}-{date}.txt")
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(format_instructions(removed, guids))
+    print("Written update instructions to ", filename)
+
+if __name__ == "__main__":
+    args = parse_args()
+    try:
+        main(args)
+    except subprocess.CalledProcessError as error:
+        print("Could not read the committed output: ", error.stderr.decode("utf-8").strip())
+        sys.exit(1)
@@ -0,0 +1,5 @@
+#!/bin/bash
+
+set -e
+
+python3 -m unittest perf_tests.py
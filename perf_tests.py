@@ -0,0 +1,199 @@
+import math
+import os
+import subprocess
+import sys
+import time
+import unittest
+from types import SimpleNamespace
+import xml.etree.ElementTree as ET
+from generate import filtered_words, format_words, is_deprecated, remove_duplications, words_to_maps
+from make_update_instructions import diff_cards
+from update_update_file import find_duplicates, find_new_cards, find_similar_cards, update_old_data
+
+# Every measurement is repeated and the fastest run is used, which filters out most of the machine noise.
+REPEATS = int(os.environ.get("PERF_REPEATS", "3"))
+# Tolerated deviation from the ideal time ratio between inputs of size 4N and N.
+SCALING_SLACK = float(os.environ.get("PERF_SCALING_SLACK", "2.0"))
+# Multiplier for the absolute stage budgets, for slow machines.
+BUDGET_FACTOR = float(os.environ.get("PERF_BUDGET_FACTOR", "1.0"))
+
+LINEAR = 1
+QUADRATIC = 2
+
+# Cumulative time for importing generate.py, which the CLI, the server and the tests pay on every start.
+# It is measured relative to importing argparse, which generate.py imports as well, so that the budget scales with the machine.
+IMPORT_BUDGET_MODULE = "argparse"
+IMPORT_BUDGET_RATIO = 4.0
+
+REFERENCE_NUMBER_OF_WORDS = 7000
+NEO_ARGS = SimpleNamespace(verbose=False, neo=True, include_archaic=False, include_deprecated=False, include_origin=False)
+NEO_LANGUAGE_IDS = ["q", "nq", "mq"]
+
+def synthetic_words(number_of_words):
+    root = ET.Element("words")
+    for i in range(number_of_words):
+        language = NEO_LANGUAGE_IDS[i % len(NEO_LANGUAGE_IDS)]
+        attributes = {"l": language, "v": f"val{i // 3}ë", "speech": ["n", "vb", "adj"][i % 3], "cat": "PW_VA"}
+        if i % 5 == 4:
+            word = ET.SubElement(root, "word", attributes)
+            ET.SubElement(word, "see", {"l": language, "v": f"val{(i - 4) // 3}ë"})
+            continue
+        attributes["gloss"] = f"meaning {i // 6}, *sense {i}; [ᴹQ.] thing {i}"
+        if i % 11 == 0:
+            attributes["mark"] = "†"
+        word = ET.SubElement(root, "word", attributes)
+        if i % 13 == 0:
+            ET.SubElement(word, "deprecated", {"l": language, "v": f"val{i // 3 + 1}ë"})
+    return root.findall(".//word")
+
+def synthetic_cards(number_of_cards):
+    cards = []
+    for i in range(number_of_cards):
+        cards.append({
+            "tolkienian_word": f"word{i // 3}",
+            "english_word": f"{'*' if i % 7 == 0 else ''}meaning{i // 6}",
+            "part_of_speech": "n",
+            "category": ["Animals", "Physical World", None][i % 3],
+        })
+    return cards
+
+def synthetic_update(number_of_cards):
+    old_data = [(f"guid{i}", f"front{i}", f"back{i}") for i in range(number_of_cards)]
+    new_data = [(f"front{i}", f"back{i}") for i in range(number_of_cards // 2)]
+    new_data += [(f"front{i}", f"changed{i}") for i in range(number_of_cards // 2, number_of_cards - 10)]
+    new_data += [(f"new{i}", f"back{i}") for i in range(10)]
+    return old_data, new_data
+
+def import_time(module):
+    """
+    Imports the module in a fresh interpreter without site packages and returns its cumulative import time as reported by -X importtime.
+    """
+    env = {key: value for key, value in os.environ.items() if key != "PYTHONDONTWRITEBYTECODE"}
+    result = subprocess.run([sys.executable, "-S", "-X", "importtime", "-c", f"import {module}"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1e6
+    raise ValueError(f"No import time reported for {module}")
+
+def best_time(function, make_input):
+    times = []
+    for _ in range(REPEATS):
+        data = make_input()
+        start = time.perf_counter()
+        function(data)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+class PerformanceTestCase(unittest.TestCase):
+    def assertScaling(self, function, make_input, n, exponent, logarithmic=False):
+        """
+        With logarithmic set, the budget is for O(N^exponent log N) instead of O(N^exponent).
+        """
+        small = best_time(function, lambda: make_input(n))
+        large = best_time(function, lambda: make_input(4 * n))
+        ratio = large / small
+        budget = 4 ** exponent * SCALING_SLACK
+        if logarithmic:
+            budget *= math.log(4 * n) / math.log(n)
+        self.assertLessEqual(ratio, budget, f"Time ratio for 4N/N inputs is {ratio:.1f}, the budget is {budget:.1f}")
+
+    def assertWithinBudget(self, function, make_input, seconds):
+        duration = best_time(function, make_input)
+        budget = seconds * BUDGET_FACTOR
+        self.assertLessEqual(duration, budget, f"Took {duration:.3f}s, the budget is {budget:.3f}s")
+
+class TestComplexityBudgets(PerformanceTestCase):
+    def test_is_deprecated_is_linear(self):
+        def check_last_word(words):
+            is_deprecated(words[-1], words)
+        def make_input(n):
+            words = synthetic_words(n)
+            words[-1].append(ET.Element("see", {"v": "missing", "l": "q"}))
+            return words
+        self.assertScaling(check_last_word, make_input, 20000, LINEAR)
+
+    def test_filtering_is_quadratic(self):
+        def filter_words(words):
+            filtered_words(NEO_ARGS, NEO_LANGUAGE_IDS, [], words)
+        self.assertScaling(filter_words, synthetic_words, 500, QUADRATIC)
+
+    def test_mapping_is_linear(self):
+        def map_words(words):
+            words_to_maps(words, [], NEO_ARGS)
+        self.assertScaling(map_words, synthetic_words, 2000, LINEAR)
+
+    def test_mapping_variants_with_cached_base_maps_is_linear(self):
+        def map_variants(words):
+            base_maps = {}
+            for include_archaic in [False, True]:
+                args = SimpleNamespace(verbose=False, neo=True, include_archaic=include_archaic, include_deprecated=False, include_origin=False)
+                words_to_maps(words, [], args, base_maps)
+        self.assertScaling(map_variants, synthetic_words, 2000, LINEAR)
+
+    def test_remove_duplications_is_linear(self):
+        self.assertScaling(remove_duplications, synthetic_cards, 2000, LINEAR)
+
+    def test_updating_anki_export_is_quadratic(self):
+        def update(data):
+            old_data, new_data = data
+            update_old_data(old_data, new_data)
+        self.assertScaling(update, synthetic_update, 300, QUADRATIC)
+
+    def test_finding_anki_duplicates_is_quadratic(self):
+        def duplicates(data):
+            old_data, _ = data
+            find_duplicates(old_data)
+        self.assertScaling(duplicates, synthetic_update, 300, QUADRATIC)
+
+    def test_finding_new_cards_is_quadratic(self):
+        def new_cards(data):
+            old_data, new_data = data
+            find_new_cards(new_data, old_data)
+        self.assertScaling(new_cards, synthetic_update, 300, QUADRATIC)
+
+    def test_pairing_similar_cards_is_linear(self):
+        def pair(data):
+            old_data, new_data = data
+            find_similar_cards(old_data, new_data, 0.6)
+        self.assertScaling(pair, synthetic_update, 2000, LINEAR)
+
+    def test_diffing_output_versions_is_linearithmic(self):
+        def diff(data):
+            old_data, new_data = data
+            diff_cards([(front, back) for _, front, back in old_data], new_data)
+        self.assertScaling(diff, synthetic_update, 20000, LINEAR, logarithmic=True)
+
+class TestStageBudgets(PerformanceTestCase):
+    """
+    Absolute budgets for the stages of a Neo-Quenya sized deck.
+    """
+    def setUp(self):
+        self.words = synthetic_words(REFERENCE_NUMBER_OF_WORDS)
+        self.filtered = filtered_words(NEO_ARGS, NEO_LANGUAGE_IDS, [], self.words)
+        self.maps = words_to_maps(self.filtered, [], NEO_ARGS)
+
+    def test_filtering_budget(self):
+        self.assertWithinBudget(lambda words: filtered_words(NEO_ARGS, NEO_LANGUAGE_IDS, [], words), lambda: self.words, 3.0)
+
+    def test_mapping_budget(self):
+        self.assertWithinBudget(lambda words: words_to_maps(words, [], NEO_ARGS), lambda: self.filtered, 1.0)
+
+    def test_deduplication_budget(self):
+        self.assertWithinBudget(remove_duplications, lambda: [word_map.copy() for word_map in self.maps], 2.0)
+
+    def test_formatting_budget(self):
+        deduplicated = remove_duplications([word_map.copy() for word_map in self.maps])
+        self.assertWithinBudget(format_words, lambda: deduplicated, 0.25)
+
+class TestStartupBudget(PerformanceTestCase):
+    def test_import_budget(self):
+        import_time("generate") # Writes the bytecode cache, so that compiling is not measured.
+        duration = min(import_time("generate") for _ in range(REPEATS))
+        baseline = min(import_time(IMPORT_BUDGET_MODULE) for _ in range(REPEATS))
+        budget = baseline * IMPORT_BUDGET_RATIO * BUDGET_FACTOR
+        self.assertLessEqual(duration, budget, f"Importing generate took {duration * 1000:.1f}ms, the budget is {budget * 1000:.1f}ms ({IMPORT_BUDGET_RATIO:g} times importing {IMPORT_BUDGET_MODULE})")
+
+if __name__ == '__main__':
+    unittest.main()
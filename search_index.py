@@ -0,0 +1,181 @@
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import generate
+
+INDEX_FILE = "input/search-index.sqlite"
+TERM_PATTERN = r"\w+"
+TERM_KINDS = ["gloss", "form"]
+# SQLite limits the number of parameters of a query.
+MAX_PARAMETERS = 500
+
+SCHEMA = """
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY,
+    l TEXT,
+    form TEXT,
+    speech TEXT,
+    gloss TEXT,
+    decks TEXT NOT NULL
+);
+CREATE TABLE terms (
+    term TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    entry_id INTEGER NOT NULL REFERENCES entries (id),
+    PRIMARY KEY (term, kind, entry_id)
+) WITHOUT ROWID;
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Look up glosses and word forms across all languages and decks.')
+    parser.add_argument('--index', type=str, default=INDEX_FILE, help='Search index database')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Build the search index from the Eldamo data')
+    build_parser.add_argument('--input', type=str, default=generate.INPUT_FILE, help='Eldamo XML file to index')
+    build_parser.add_argument('--parser', type=str, choices=generate.PARSER_BACKENDS, default="auto", help='XML parser to use')
+
+    search_parser = subparsers.add_parser('search', help='Find the words whose gloss or form contains all words of the query')
+    search_parser.add_argument('query', type=str, help='Words to search for, e.g. hive')
+    search_parser.add_argument('--kind', type=str, choices=TERM_KINDS, default=None, help='Only search glosses or only Tolkienian word forms')
+    search_parser.add_argument('--language', type=str, default=None, help='Only show words of this language')
+
+    return parser.parse_args()
+
+def get_terms(text):
+    """
+    Folds the text like variants of a translation are folded, and returns its words.
+    Optional parts in parentheses are indexed both with and without the part.
+    """
+    folded = generate.fold_variant(text)
+    longer_variant = folded.replace("(", "").replace(")", "")
+    shorter_variant = generate.get_regex(r'\(.*?\)').sub('', folded)
+    regex = generate.get_regex(TERM_PATTERN)
+    return set(regex.findall(longer_variant)) | set(regex.findall(shorter_variant))
+
+def get_form(word):
+    """
+    The Tolkienian word form, spelled like on the cards.
+    """
+    form = {"tolkienian_word": word.get('v'), "language": word.get('l')}
+    generate.remove_duplication_marker(form)
+    if generate.is_quenya(form):
+        generate.normalise_quenya_spelling(form)
+    return form["tolkienian_word"]
+
+def get_glosses(word, words_by_key):
+    glosses = [gloss for gloss in [word.get('gloss'), word.get('ngloss')] if gloss]
+    if not glosses and word.find('see') is not None:
+        see = word.find('see')
+        referenced_word = words_by_key.get((see.get('v'), see.get('l')))
+        if referenced_word is not None:
+            glosses = [gloss for gloss in [referenced_word.get('gloss'), referenced_word.get('ngloss')] if gloss]
+    return glosses
+
+def get_decks_by_word(db):
+    """
+    Maps the id of every word to the published decks whose filters it passes.
+    """
+    decks_by_word = {}
+    for language, neo in generate.ALL_DECKS:
+        options = generate.deck_options(language, neo=neo)
+        languages = generate.get_languages_to_generate(options)
+        language_ids = [lang.get("id") for lang in languages]
+        words = db.words_for_languages(language_ids)
+        deck = generate.get_deck_name(options, languages)
+        for word in generate.filtered_words(options, language_ids, generate.get_speech_types_to_exclude(options), words):
+            decks_by_word.setdefault(id(word), []).append(deck)
+    return decks_by_word
+
+def build_index(db, index_file):
+    words_by_key = {}
+    for word in db.words:
+        words_by_key.setdefault((word.get('v'), word.get('l')), word)
+    decks_by_word = get_decks_by_word(db)
+
+    with generate.file_lock(index_file):
+        temp_file = index_file + ".part"
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        connection = sqlite3.connect(temp_file)
+        try:
+            connection.executescript(SCHEMA)
+            for entry_id, word in enumerate(db.words):
+                if word.get('v') is None:
+                    continue
+                glosses = get_glosses(word, words_by_key)
+                form = get_form(word)
+                connection.execute(
+                    "INSERT INTO entries (id, l, form, speech, gloss, decks) VALUES (?, ?, ?, ?, ?, ?)",
+                    (entry_id, word.get('l'), form, word.get('speech'), "; ".join(glosses), json.dumps(decks_by_word.get(id(word), []))))
+                terms = [(term, "form", entry_id) for term in get_terms(form)]
+                terms.extend((term, "gloss", entry_id) for term in set().union(*[get_terms(gloss) for gloss in glosses]))
+                connection.executemany("INSERT INTO terms (term, kind, entry_id) VALUES (?, ?, ?)", terms)
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(temp_file, index_file)
+
+def select_in(connection, query, parameters, values):
+    """
+    Runs a query ending in "IN ({placeholders})" for batches of the values and returns all rows.
+    """
+    rows = []
+    values = sorted(values)
+    for i in range(0, len(values), MAX_PARAMETERS):
+        batch = values[i:i + MAX_PARAMETERS]
+        placeholders = ", ".join("?" for _ in batch)
+        rows.extend(connection.execute(query.format(placeholders=placeholders), parameters + batch))
+    return rows
+
+def search(index_file, query, kinds=TERM_KINDS, language=None):
+    """
+    Returns the entries whose gloss or form contains every word of the query, as dicts.
+    """
+    if not os.path.exists(index_file):
+        raise ValueError(f"Search index {index_file} not found. Create it with search_index.py build first.")
+    terms = get_terms(query)
+    if not terms:
+        return []
+    with contextlib.closing(sqlite3.connect(f"file:{index_file}?mode=ro", uri=True)) as connection:
+        entry_ids = set()
+        for kind in kinds:
+            # Starting with the rarest term, the other terms only have to be looked up for the remaining candidates.
+            counts = {term: connection.execute("SELECT COUNT(*) FROM terms WHERE term = ? AND kind = ?", (term, kind)).fetchone()[0] for term in terms}
+            rarest_term, *other_terms = sorted(terms, key=lambda term: (counts[term], term))
+            rows = connection.execute("SELECT entry_id FROM terms WHERE term = ? AND kind = ?", (rarest_term, kind))
+            matches = set(entry_id for entry_id, in rows)
+            for term in other_terms:
+                if not matches:
+                    break
+                rows = select_in(connection, "SELECT entry_id FROM terms WHERE term = ? AND kind = ? AND entry_id IN ({placeholders})", [term, kind], matches)
+                matches = set(entry_id for entry_id, in rows)
+            entry_ids |= matches
+        rows = select_in(connection, "SELECT id, l, form, speech, gloss, decks FROM entries WHERE id IN ({placeholders})", [], entry_ids)
+    rows = [row[1:] for row in sorted(rows)]
+    entries = [{"l": l, "form": form, "speech": speech, "gloss": gloss, "decks": json.loads(decks)} for l, form, speech, gloss, decks in rows]
+    if language is not None:
+        language_id = generate.get_languages_to_generate(generate.deck_options(language))[0].get("id")
+        entries = [entry for entry in entries if entry["l"] == language_id]
+    return entries
+
+def format_entry(entry):
+    language_names = {lang.get("id"): lang.get("name") for lang in generate.SUPPORTED_LANGUAGES}
+    decks = ", ".join(entry["decks"]) if entry["decks"] else "no deck"
+    return f"{language_names.get(entry['l'], entry['l'])} | {entry['form']} | {entry['speech']} | {entry['gloss']} | {decks}"
+
+def main(args):
+    if args.command == "build":
+        db = generate.EldamoDatabase.from_file(args.input, args.parser)
+        build_index(db, args.index)
+        print("Written search index to ", args.index)
+    elif args.command == "search":
+        kinds = TERM_KINDS if args.kind is None else [args.kind]
+        for entry in search(args.index, args.query, kinds, args.language):
+            print(format_entry(entry))
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
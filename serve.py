@@ -0,0 +1,182 @@
+import argparse
+import collections
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import generate
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+DEFAULT_CACHE_SIZE = 64
+TRUE_VALUES = ["1", "true", "yes", "on", ""]
+RELOAD_ERRORS = (OSError, SyntaxError, ValueError)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve Anki decks generated from a resident copy of the Eldamo data.')
+    parser.add_argument('--host', type=str, default=DEFAULT_HOST, help='Address to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE, help='Number of generated decks to keep in memory')
+    parser.add_argument('--overlay', dest='overlays', action='append', default=None, help='XML or CSV file with words that are merged into the Eldamo data; reloaded when it changes')
+    parser.add_argument('--check-for-updates', action='store_true', default=False, help='Forces a re-download of the Eldamo database on startup')
+    parser.add_argument('--verbose', action='store_true', default=False, help='Print more output')
+
+    return parser.parse_args()
+
+def file_mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+def is_true(value):
+    return value.lower() in TRUE_VALUES
+
+def normalise_options(language, flags):
+    options = generate.deck_options(language, **{option: bool(value) for option, value in flags.items()})
+    languages = generate.get_languages_to_generate(options)
+    options.language = languages[0].get("id")
+    if not options.neo:
+        for option in generate.NEO_ONLY_DECK_OPTIONS:
+            setattr(options, option, False)
+    return options
+
+def options_key(options):
+    return (options.language,) + tuple(getattr(options, option) for option in generate.DECK_OPTIONS)
+
+def options_from_query(query):
+    parameters = parse_qs(query, keep_blank_values=True)
+    languages = parameters.get("language")
+    if not languages:
+        raise ValueError("Missing parameter: language")
+    flags = {}
+    for name, values in parameters.items():
+        option = name.replace("-", "_")
+        if option in generate.DECK_OPTIONS:
+            flags[option] = is_true(values[-1])
+        elif option != "language":
+            raise ValueError(f"Unknown parameter: {name}")
+    return normalise_options(languages[-1], flags)
+
+class DeckService:
+    """
+    Files that change while serving are parsed outside self.lock, so cached decks are still served during a reload.
+    A file that cannot be read is reported once and the previous data is kept until the file changes again.
+    """
+    def __init__(self, cache_size=DEFAULT_CACHE_SIZE, verbose=False, overlays=None):
+        self.cache_size = cache_size
+        self.verbose = verbose
+        self.overlays = overlays or []
+        self.lock = threading.Lock()
+        self.reload_lock = threading.Lock()
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.base_db = None
+        self.db = None
+        self.input_mtime = None
+        self.overlay_mtimes = None
+
+    def load(self):
+        self.input_mtime = os.stat(generate.INPUT_FILE).st_mtime_ns
+        base_db = generate.EldamoDatabase.from_file(generate.INPUT_FILE)
+        if self.verbose:
+            print("Loaded ", len(base_db.words), " words from ", generate.INPUT_FILE)
+        self.load_overlays(base_db)
+
+    def load_overlays(self, base_db=None):
+        """
+        Only the overlays are read again, the Eldamo data stays loaded.
+        """
+        base_db = base_db or self.base_db
+        self.overlay_mtimes = [os.stat(overlay).st_mtime_ns for overlay in self.overlays]
+        db = generate.apply_overlays(base_db, self.overlays)
+        with self.lock:
+            self.base_db = base_db
+            self.db = db
+            self.cache.clear()
+
+    def reload_if_changed(self):
+        if not self.reload_lock.acquire(blocking=False):
+            return
+        try:
+            input_mtime = file_mtime(generate.INPUT_FILE)
+            overlay_mtimes = [file_mtime(overlay) for overlay in self.overlays]
+            if input_mtime != self.input_mtime:
+                self.input_mtime = input_mtime
+                self.overlay_mtimes = overlay_mtimes
+                self.load()
+            elif overlay_mtimes != self.overlay_mtimes:
+                self.overlay_mtimes = overlay_mtimes
+                self.load_overlays()
+        except RELOAD_ERRORS as error:
+            print("Could not reload the decks, serving the previous data: ", error)
+        finally:
+            self.reload_lock.release()
+
+    def generate(self, options):
+        self.reload_if_changed()
+        key = options_key(options)
+        with self.lock:
+            cards = self.cache.get(key)
+            if cards is not None:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return cards
+            self.misses += 1
+            db = self.db
+
+        cards = "".join(generate.generate_deck(db, options))
+
+        with self.lock:
+            if self.db is db:
+                self.cache[key] = cards
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return cards
+
+def make_handler(service):
+    class DeckRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/deck":
+                self.send_text(404, "Not found\n")
+                return
+            try:
+                options = options_from_query(url.query)
+            except ValueError as error:
+                self.send_text(400, f"{error}\n")
+                return
+            self.send_text(200, service.generate(options))
+
+        def send_text(self, status, text):
+            body = text.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if service.verbose:
+                super().log_message(format, *args)
+
+    return DeckRequestHandler
+
+def main(args):
+    generate.ensure_endamo_data(args)
+    service = DeckService(args.cache_size, args.verbose, args.overlays)
+    service.load()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving decks on http://{args.host}:{server.server_port}/deck?language=<language>")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)
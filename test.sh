@@ -2,4 +2,4 @@
 
 set -e
 
-python3 -m unittest test_generate.py
+python3 -m unittest discover -p "test_*.py"
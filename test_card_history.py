@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from card_history import find_changes, import_anki_export, match_cards, update_card_history
+
+def card(tolkienian_word, english_word, part_of_speech="n", sources=None):
+    return {
+        "tolkienian_word": tolkienian_word,
+        "english_word": english_word,
+        "part_of_speech": part_of_speech,
+        "sources": sources if sources is not None else [["q", tolkienian_word]],
+    }
+
+FIRST_RUN = [
+    card("alda", "tree"),
+    card("lassë", "leaf"),
+    card("nén", "water"),
+    card("ondo", "stone", sources=[["q", "ondo"]]),
+]
+SECOND_RUN = [
+    card("alda", "tree"),
+    card("lassë", "leaf; foliage"),
+    card("ondo (Rocks)", "rock", sources=[["q", "ondo"]]),
+    card("vanya", "fair", part_of_speech="adj"),
+]
+
+class TestCardHistory(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.history_file = os.path.join(self.directory.name, "history.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_cards(self):
+        connection = sqlite3.connect(self.history_file)
+        try:
+            return {front: (back, first_seen_run, last_changed_run, removed_run) for front, back, first_seen_run, last_changed_run, removed_run in connection.execute(
+                "SELECT front, back, first_seen_run, last_changed_run, removed_run FROM cards")}
+        finally:
+            connection.close()
+
+    def test_match_cards_prefers_identical_cards(self):
+        current_cards = {
+            1: ("alda", "tree (n)", frozenset([("q", "alda")])),
+            2: ("alda", "wood (n)", frozenset([("q", "alda")])),
+        }
+        new_cards = [("alda", "wood (n)", frozenset([("q", "alda")]))]
+        unchanged, changed, added, removed = match_cards(current_cards, new_cards)
+        self.assertEqual(unchanged, [(2, new_cards[0])])
+        self.assertEqual((changed, added, removed), ([], [], [1]))
+
+    def test_only_changed_cards_are_written(self):
+        first_run = update_card_history(self.history_file, "Quenya", FIRST_RUN)
+        second_run = update_card_history(self.history_file, "Quenya", SECOND_RUN)
+        cards = self.read_cards()
+        self.assertEqual(cards["alda"], ("tree (n)", first_run, first_run, None))
+        self.assertEqual(cards["lassë"], ("leaf; foliage (n)", first_run, second_run, None))
+        self.assertEqual(cards["nén"], ("water (n)", first_run, second_run, second_run))
+        self.assertEqual(cards["vanya"], ("fair (adj)", second_run, second_run, None))
+
+    def test_cards_keep_their_identity_through_their_source_words(self):
+        first_run = update_card_history(self.history_file, "Quenya", FIRST_RUN)
+        second_run = update_card_history(self.history_file, "Quenya", SECOND_RUN)
+        cards = self.read_cards()
+        self.assertNotIn("ondo", cards)
+        self.assertEqual(cards["ondo (Rocks)"], ("rock (n)", first_run, second_run, None))
+
+    def test_decks_are_tracked_separately(self):
+        update_card_history(self.history_file, "Quenya", FIRST_RUN)
+        update_card_history(self.history_file, "Neo-Quenya", [])
+        self.assertEqual(len([value for value in self.read_cards().values() if value[3] is None]), 4)
+
+    def test_changes_since_a_release(self):
+        first_run = update_card_history(self.history_file, "Quenya", FIRST_RUN)
+        anki_export = os.path.join(self.directory.name, "Quenya.txt")
+        with open(anki_export, "w", encoding="utf-8") as f:
+            f.write("#separator:tab\n")
+            f.write("k5p}?8Y>gk\tnén\twater (n)\t\n")
+        self.assertEqual(import_anki_export(self.history_file, "Quenya", anki_export), 1)
+        update_card_history(self.history_file, "Quenya", SECOND_RUN)
+
+        changes = find_changes(self.history_file, "Quenya", first_run)
+        self.assertEqual(changes["added"], [(None, "vanya", "fair (adj)")])
+        self.assertEqual(changes["changed"], [(None, "lassë", "leaf; foliage (n)"), (None, "ondo (Rocks)", "rock (n)")])
+        self.assertEqual(changes["removed"], [("k5p}?8Y>gk", "nén", "water (n)")])
+
+        changes = find_changes(self.history_file, "Quenya", 0)
+        self.assertEqual(len(changes["added"]), 4)
+        self.assertEqual(changes["changed"], [])
+        self.assertEqual(changes["removed"], [])
+
+if __name__ == '__main__':
+    unittest.main()
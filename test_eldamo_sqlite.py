@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from eldamo_sqlite import import_eldamo_data, open_eldamo_database
+from fixtures import FIXTURE_FILE, fixture_database
+from generate import ALL_DECKS, EldamoDatabase, deck_options, generate_deck
+from test_generate import dict_to_xml
+
+def eldamo_root():
+    root = ET.Element("eldamo")
+    cats = ET.SubElement(root, "cats")
+    ET.SubElement(cats, "cat-group", {"id": "PW", "label": "Physical World"})
+    ET.SubElement(cats, "cat-group", {"id": "AN", "label": "Animals"})
+    neresta = dict_to_xml("word", {"l": "q", "v": "ne(re)sta", "speech": "fraction", "gloss": "one ninth"})
+    nersat = dict_to_xml("word", {"l": "q", "v": "nersat", "speech": "fraction", "gloss": "one ninth", "deprecated": {"l": "q", "v": "ne(re)sta"}})
+    neresta.append(nersat)
+    root.append(neresta)
+    root.append(dict_to_xml("word", {"l": "q", "v": "imbë²", "speech": "n", "ngloss": "deep valley, [ᴹQ.] glen", "cat": "PW_VA"}))
+    root.append(dict_to_xml("word", {"l": "mq", "v": "imbe²", "speech": "n", "gloss": "dell, ravine", "cat": "PW_VA"}))
+    root.append(dict_to_xml("word", {"l": "q", "v": "nierë", "speech": "n", "see": {"l": "q", "v": "nier"}}))
+    root.append(dict_to_xml("word", {"l": "q", "v": "nier", "speech": "n", "gloss": "bee", "cat": "AN_IN"}))
+    root.append(dict_to_xml("word", {"l": "s", "v": "galadh", "speech": "n", "gloss": "tree"}))
+    return root
+
+class TestEldamoSqlite(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.database_file = os.path.join(self.temp_dir.name, "eldamo-data.sqlite")
+        self.root = eldamo_root()
+        import_eldamo_data(self.root, self.database_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_database_is_indexed(self):
+        connection = sqlite3.connect(self.database_file)
+        indexes = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        for index in ["words_l", "words_v", "words_speech"]:
+            self.assertIn(index, indexes)
+        links = connection.execute("SELECT kind, v FROM word_links ORDER BY word_id").fetchall()
+        self.assertEqual(links, [("deprecated", "ne(re)sta"), ("see", "nier")])
+        connection.close()
+        self.assertFalse(os.path.exists(self.database_file + ".part"))
+
+    def test_decks_match_the_xml_input(self):
+        xml_db = EldamoDatabase.from_root(self.root)
+        sqlite_db = open_eldamo_database(self.database_file)
+        self.assertEqual(sqlite_db.categories, xml_db.categories)
+        for options in [deck_options("quenya"), deck_options("quenya", neo=True), deck_options("quenya", neo=True, include_deprecated=True), deck_options("sindarin")]:
+            self.assertEqual(generate_deck(sqlite_db, options), generate_deck(xml_db, options))
+
+    def test_all_decks_match_the_fixture(self):
+        import_eldamo_data(ET.parse(FIXTURE_FILE).getroot(), self.database_file)
+        sqlite_db = open_eldamo_database(self.database_file)
+        for language, neo in ALL_DECKS:
+            options = deck_options(language, neo=neo)
+            self.assertEqual(generate_deck(sqlite_db, options), generate_deck(fixture_database(), options))
+
+    def test_missing_database_is_reported(self):
+        with self.assertRaises(ValueError):
+            open_eldamo_database(os.path.join(self.temp_dir.name, "missing.sqlite"))
+
+if __name__ == '__main__':
+    unittest.main()
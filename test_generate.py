@@ -1,7 +1,22 @@
+import contextlib
+import gzip
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from types import SimpleNamespace
+from unittest import mock
 import xml.etree.ElementTree as ET
-from generate import add_uniqueness_via_field, are_english_duplicates, are_tolkienian_duplicates, filtered_words, format_word, format_words, include_tengwar_info, make_tolkienian_duplicates_unique, merge_duplicates, normalise_quenya_spelling, parse_args, remove_deprecated_translations, remove_duplicate_translations, main, remove_duplications, remove_origin_marker, split_word_map, words_to_maps
+import generate
+from fixtures import FIXTURE_FILE, fixture_database
+from generate import ARCHAIC_MARKER, parse_in_parallel, word_to_record, DEPRECATED_MARKER, EldamoDatabase, add_uniqueness_via_field, tokenize_gloss, format_prometheus_metrics, new_metrics, write_metrics, find_duplication_components, remove_duplications_sharded, are_english_duplicates, are_tolkienian_duplicates, deck_options, filtered_words, format_word, format_words, generate_cards_with_checkpoints, get_parser_backend, read_endamo_data, generate_deck, include_tengwar_info, make_tolkienian_duplicates_unique, merge_duplicates, normalise_quenya_spelling, parse_args, remove_deprecated_translations, stream_endamo_data, remove_duplicate_translations, main, remove_duplications, remove_origin_marker, split_word_map, words_to_maps, write_file_atomically, write_to_file
 
 def dict_to_xml(tag, d):
     elem = ET.Element(tag)
@@ -21,6 +36,33 @@ def list_to_xml(list):
         root.append(dict_to_xml("word", d))
     return ET.ElementTree(root)
 
+def synthetic_eldamo_data(number_of_words):
+    root = ET.Element("eldamo")
+    cats = ET.SubElement(root, "cats")
+    ET.SubElement(cats, "cat-group", {"id": "AN", "label": "Animals"})
+    for i in range(number_of_words):
+        ET.SubElement(root, "word", {"l": "q", "v": f"word{i}", "speech": "n", "gloss": f"gloss {i}"})
+    return ET.tostring(root, encoding="utf-8")
+
+class SlowEldamoHandler(BaseHTTPRequestHandler):
+    content = b""
+    chunk_size = 1024
+    latency = 0.001
+    requests_served = 0
+
+    def do_GET(self):
+        SlowEldamoHandler.requests_served += 1
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.content)))
+        self.end_headers()
+        for i in range(0, len(self.content), self.chunk_size):
+            self.wfile.write(self.content[i:i + self.chunk_size])
+            self.wfile.flush()
+            time.sleep(self.latency)
+
+    def log_message(self, format, *args):
+        pass
+
 class TestGenerate(unittest.TestCase):
     def test_include_tengwar_info(self):
         word = {"tolkienian_word": "mísë", "tengwar": "þ"}
@@ -100,6 +142,18 @@ class TestGenerate(unittest.TestCase):
         remove_origin_marker(word)
         self.assertEqual(word["english_word"], "skill; magic, wizardry")
 
+    def test_removing_a_trailing_origin_marker_leaves_no_empty_translation(self):
+        db = EldamoDatabase.from_root(list_to_xml([
+            {"l": "q", "v": "qua", "speech": "vb", "gloss": "föo; *run; [ᴹQ.]"},
+            {"l": "q", "v": "ñoldoa", "speech": "n", "gloss": "† arch, [ᴹQ.]"},
+            {"l": "q", "v": "lassë", "speech": "n", "gloss": "leaf, [ᴹQ.] ⚠️foliage"},
+        ]).getroot())
+        self.assertEqual(generate_deck(db, deck_options("quenya", neo=True, include_archaic=True)), [
+            "lassë|leaf (n)\n",
+            "noldöa [ñ-]|† arch (n)\n",
+            "qua|to föo; to *run (vb)\n",
+        ])
+
     def test_normalise_quenya_spelling(self):
         word = {"language": "q", "tolkienian_word": "aksa akwa aka aqa aqua"}
         normalise_quenya_spelling(word)
@@ -462,6 +516,15 @@ class TestGenerate(unittest.TestCase):
         self.assertEqual(len(maps), 1)
         self.assertEqual(maps[0]["english_word"], "(orig.) to bla")
 
+    def test_gloss_tokenizer_drops_translations_after_markers(self):
+        self.assertEqual(tokenize_gloss("fresh, new, ⚠️renewed; †young", [DEPRECATED_MARKER, ARCHAIC_MARKER]), ["fresh", "new"])
+        self.assertEqual(tokenize_gloss("old (of people), aged; †hoary", [ARCHAIC_MARKER]), ["old (of people)", "aged"])
+        self.assertEqual(tokenize_gloss("fresh, new, ⚠️renewed", []), ["fresh", "new", "⚠️renewed"])
+
+    def test_gloss_tokenizer_prepends_to_for_verbs(self):
+        tokens = tokenize_gloss("go, *to come, (lit.) walk, may; †wend", [ARCHAIC_MARKER], is_verb=True)
+        self.assertEqual(tokens, ["to go", "*to come", "(lit.) to walk", "may"])
+
     def test_words_are_only_split_outside_parenthesis(self):
         words = {"tolkienian_word": "cólima", "english_word": "bearable, light (of burdens and things comparable, troubles, labors, afflications)"}
         maps = split_word_map(words)
@@ -527,11 +590,19 @@ class TestGenerate(unittest.TestCase):
         formatted = format_word(word)
         self.assertEqual(formatted, "mísë (extra)|grey (adj)\n")
 
-    def test_generating_sindarin_does_not_throw(self):
-        args = parse_args()
-        args.language = 'sindarin'
-        main(args)
-    
+    def test_elvish_sort_order_folds_diacritics(self):
+        words = [
+            {"tolkienian_word": "Þindë", "english_word": "grey"},
+            {"tolkienian_word": "ára", "english_word": "dawn"},
+            {"tolkienian_word": "tyelpë", "english_word": "silver"},
+            {"tolkienian_word": "ñoldo", "english_word": "Noldo"},
+            {"tolkienian_word": "nár", "english_word": "fire"},
+            {"tolkienian_word": "(a)lá", "english_word": "yes"},
+            {"tolkienian_word": "anna", "english_word": "gift"},
+        ]
+        self.assertEqual(format_words(words), ["(a)lá|yes\n", "anna|gift\n", "nár|fire\n", "tyelpë|silver\n", "Þindë|grey\n", "ára|dawn\n", "ñoldo|Noldo\n"])
+        self.assertEqual(format_words(words, "elvish"), ["(a)lá|yes\n", "anna|gift\n", "ára|dawn\n", "nár|fire\n", "ñoldo|Noldo\n", "Þindë|grey\n", "tyelpë|silver\n"])
+
     def test_imbe(self):
         words = [
             {"l": "eq", "v": "imbe", "speech": "n", "gloss": "hive", "cat": "AN_BE"},
@@ -617,5 +688,605 @@ class TestGenerate(unittest.TestCase):
 
         self.assertEqual(formatted, expected)
 
+class TestShardedDeduplication(unittest.TestCase):
+    def cards(self):
+        return [
+            {"tolkienian_word": "imbë", "english_word": "between", "part_of_speech": "prep"},
+            {"tolkienian_word": "alda", "english_word": "tree", "part_of_speech": "n"},
+            {"tolkienian_word": "imbë", "english_word": "dell", "part_of_speech": "n", "category": "Physical World"},
+            {"tolkienian_word": "galadh", "english_word": "*tree", "part_of_speech": "n"},
+            {"tolkienian_word": "lassë", "english_word": "leaf", "part_of_speech": "n"},
+        ]
+
+    def test_cards_are_split_into_connected_components(self):
+        components = find_duplication_components(self.cards())
+        self.assertEqual(components, [[0, 2], [1, 3], [4]])
+
+    def test_sharded_deduplication_matches_global_deduplication(self):
+        expected_cards = self.cards()
+        generate.remove_duplications_in_place(expected_cards)
+        expected = format_words([card for card in expected_cards if card.get("tolkienian_word") is not None])
+        self.assertEqual(format_words(remove_duplications(self.cards())), expected)
+        self.assertEqual(format_words(remove_duplications(self.cards(), workers=2)), expected)
+
+    def test_merged_values_connecting_components_fall_back_to_global_deduplication(self):
+        cards = [
+            {"tolkienian_word": "a", "english_word": "x", "part_of_speech": "n"},
+            {"tolkienian_word": "a", "english_word": "y", "part_of_speech": "n"},
+            {"tolkienian_word": "b", "english_word": "x; y", "part_of_speech": "n"},
+        ]
+        self.assertIsNone(remove_duplications_sharded([card.copy() for card in cards], 1))
+        self.assertEqual(format_words(remove_duplications(cards)), ["a; b|x; y (n)\n"])
+
+class TestEldamoDatabase(unittest.TestCase):
+    def setUp(self):
+        root = list_to_xml([
+            {"l": "q", "v": "alda", "speech": "n", "gloss": "tree"},
+            {"l": "s", "v": "galadh", "speech": "n", "gloss": "tree"},
+            {"l": "mq", "v": "lasse", "speech": "n", "gloss": "leaf"},
+            {"l": "nq", "v": "olwa", "speech": "n", "ngloss": "branch"},
+            {"l": "q", "v": "Elessar", "speech": "masc-name", "gloss": "Elfstone"},
+            {"l": "q", "v": "alya", "speech": "adj", "gloss": "rich", "mark": "†"},
+        ]).getroot()
+        self.db = EldamoDatabase.from_root(root)
+
+    def test_words_are_indexed_by_language_in_document_order(self):
+        words = self.db.words_for_languages(["nq", "q", "mq"])
+        self.assertEqual([word.get("v") for word in words], ["alda", "lasse", "olwa", "Elessar", "alya"])
+        self.assertEqual(self.db.words_for_languages(["kh"]), [])
+
+    def test_several_decks_from_one_database(self):
+        self.assertEqual(generate_deck(self.db, deck_options("quenya")), ["alda|tree (n)\n"])
+        neo = generate_deck(self.db, deck_options("quenya", neo=True, individual_names=True, include_archaic=True))
+        self.assertEqual(neo, ["Elessar|Elfstone (masc-name)\n", "alda|tree (n)\n", "alya|rich (adj)\n", "lassë|leaf (n)\n", "olwa|branch (n)\n"])
+        self.assertEqual(generate_deck(self.db, deck_options("s")), ["galadh|tree (n)\n"])
+
+    def test_generating_decks_concurrently(self):
+        options = [deck_options("quenya", neo=neo, individual_names=names) for neo in [False, True] for names in [False, True]]
+        expected = [generate_deck(self.db, option) for option in options]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda option: generate_deck(self.db, option), options * 10))
+        self.assertEqual(results, expected * 10)
+
+    def test_variants_reuse_the_option_independent_base_maps(self):
+        with mock.patch.object(generate, "normalise_quenya_spelling", wraps=generate.normalise_quenya_spelling) as normalise:
+            generate_deck(self.db, deck_options("quenya", neo=True))
+            calls = normalise.call_count
+            generate_deck(self.db, deck_options("quenya", neo=True, include_archaic=True, individual_names=True))
+            generate_deck(self.db, deck_options("quenya", neo=True, include_origin=True))
+        self.assertEqual(calls, 3)
+        self.assertEqual(normalise.call_count, 5)
+
+    def test_neo_decks_reuse_the_cards_of_plain_decks(self):
+        db = EldamoDatabase.from_root(list_to_xml([
+            {"l": "q", "v": "alda", "speech": "n", "gloss": "tree"},
+            {"l": "q", "v": "aldë", "speech": "n", "see": {"l": "q", "v": "alda"}},
+            {"l": "q", "v": "lótë", "speech": "n", "gloss": "flower", "ngloss": "flower, blossom"},
+            {"l": "q", "v": "yávë", "speech": "n", "gloss": "fruit, ⚠️harvest"},
+            {"l": "mq", "v": "alda", "speech": "n", "gloss": "[ᴹQ.] tree"},
+            {"l": "nq", "v": "lassë", "speech": "n", "gloss": "leaf"},
+        ]).getroot())
+        card_sets = {"q": {}, "mq": {}}
+        generate_deck(db, deck_options("quenya"), None, card_sets)
+        metrics = new_metrics()
+        cards = generate_deck(db, deck_options("quenya", neo=True), metrics, card_sets)
+        self.assertEqual(cards, generate_deck(db, deck_options("quenya", neo=True)))
+        self.assertEqual(metrics["cache"]["card_sets"], {"hits": 1, "misses": 3})
+
+    def test_batch_decks_match_single_decks(self):
+        card_sets = {language_id: {} for language_id in ["p", "mq", "q", "n", "s"]}
+        for language, neo in generate.ALL_DECKS:
+            options = deck_options(language, neo=neo)
+            self.assertEqual(generate_deck(fixture_database(), options, None, card_sets), generate_deck(fixture_database(), options))
+
+    def test_unknown_deck_options_are_rejected(self):
+        with self.assertRaises(ValueError):
+            deck_options("quenya", archaic=True)
+
+class TestOverlays(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.db = EldamoDatabase.from_root(list_to_xml([
+            {"l": "q", "v": "alda", "speech": "n", "gloss": "tree"},
+            {"l": "q", "v": "aldë", "speech": "n", "see": {"l": "q", "v": "alda"}},
+            {"l": "s", "v": "galadh", "speech": "n", "gloss": "tree"},
+        ]).getroot())
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write_overlay(self, filename, content):
+        path = os.path.join(self.temp_dir.name, filename)
+        with open(path, 'w', encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def test_xml_overlay_fixes_and_adds_words(self):
+        overlay = self.write_overlay("overlay.xml",
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<word l="q" v="alda" gloss="tree, wood"/>\n'
+            '<word l="q" v="lassë" speech="n" gloss="leaf"/>\n')
+        db = generate.apply_overlays(self.db, [overlay])
+        self.assertEqual(generate_deck(db, deck_options("quenya")), ["alda; aldë|tree; wood (n)\n", "lassë|leaf (n)\n"])
+        self.assertEqual(generate_deck(db, deck_options("sindarin")), ["galadh|tree (n)\n"])
+        self.assertEqual(generate_deck(self.db, deck_options("quenya")), ["alda; aldë|tree (n)\n"])
+
+    def test_csv_overlay_replaces_links(self):
+        overlay = self.write_overlay("overlay.csv", "l,v,speech,gloss,see\nq,aldë,,,q:lassë\nq,lassë,n,leaf,\n")
+        db = generate.apply_overlays(self.db, [overlay])
+        self.assertEqual(generate_deck(db, deck_options("quenya")), ["alda|tree (n)\n", "aldë; lassë|leaf (n)\n"])
+
+    def test_later_overlays_take_precedence(self):
+        first = self.write_overlay("first.csv", "l,v,gloss\nq,alda,wood\n")
+        second = self.write_overlay("second.xml", '<word l="q" v="alda" speech="adj" gloss="wooden"/>')
+        db = generate.apply_overlays(self.db, [first, second])
+        self.assertEqual(generate_deck(db, deck_options("quenya")), ["alda|wooden (adj)\n", "aldë|wooden (n)\n"])
+        self.assertNotEqual(generate.get_input_hash(deck_options("quenya", overlays=[first]), first), generate.get_input_hash(deck_options("quenya", overlays=[second]), first))
+
+class TestWritingOutput(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.temp_dir.name, "Quenya.txt")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_unchanged_output_is_not_rewritten(self):
+        self.assertTrue(write_file_atomically(self.filename, "alda|tree (n)\n".encode("utf-8")))
+        os.utime(self.filename, ns=(0, 0))
+        self.assertFalse(write_file_atomically(self.filename, "alda|tree (n)\n".encode("utf-8")))
+        self.assertEqual(os.stat(self.filename).st_mtime_ns, 0)
+
+    def test_changed_output_is_replaced(self):
+        write_file_atomically(self.filename, "alda|tree (n)\n".encode("utf-8"))
+        self.assertTrue(write_file_atomically(self.filename, "lassë|leaf (n)\n".encode("utf-8")))
+        with open(self.filename, 'r', encoding="utf-8") as f:
+            self.assertEqual(f.read(), "lassë|leaf (n)\n")
+        self.assertEqual(os.listdir(self.temp_dir.name), ["Quenya.txt"])
+
+    def test_failed_write_keeps_the_old_output(self):
+        write_file_atomically(self.filename, b"old")
+        with mock.patch.object(os, "replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                write_file_atomically(self.filename, b"new")
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(f.read(), b"old")
+        self.assertEqual(os.listdir(self.temp_dir.name), ["Quenya.txt"])
+
+    def test_gzip_copy_is_written(self):
+        args = SimpleNamespace(neo=False, gzip=True)
+        cwd = os.getcwd()
+        os.chdir(self.temp_dir.name)
+        try:
+            write_to_file(args, [{"id": "q", "name": "Quenya"}], ["alda|tree (n)\n"])
+        finally:
+            os.chdir(cwd)
+        with gzip.open(os.path.join(self.temp_dir.name, "output", "Quenya.txt.gz"), 'rt', encoding="utf-8") as f:
+            self.assertEqual(f.read(), "alda|tree (n)\n")
+
+class TestEndToEnd(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch.object(generate, "INPUT_FILE", FIXTURE_FILE),
+            mock.patch.object(generate, "OUTPUT_DIR", self.temp_dir.name),
+            mock.patch.object(generate, "FINGERPRINT_FILE", os.path.join(self.temp_dir.name, "input", "fingerprints.json")),
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def run_main(self, *argv):
+        with mock.patch.object(sys, "argv", ["generate.py", *argv, "--parser", "stdlib"]):
+            args = parse_args()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main(args)
+        return output.getvalue()
+
+    def read_output(self, deck):
+        with open(os.path.join(self.temp_dir.name, deck + ".txt"), 'r', encoding="utf-8") as f:
+            return f.read()
+
+    def test_generating_sindarin(self):
+        self.run_main("sindarin")
+        self.assertEqual(os.listdir(self.temp_dir.name), ["Sindarin.txt"])
+        output = self.read_output("Sindarin")
+        self.assertIn("galadh|tree (n)\n", output)
+        self.assertIn("gaur [ng-]|werewolf (n)\n", output)
+        self.assertNotIn("\naew|", output)
+
+    def test_generating_all_decks(self):
+        self.run_main("all")
+        self.assertEqual(len([filename for filename in os.listdir(self.temp_dir.name) if filename.endswith(".txt")]), len(generate.ALL_DECKS))
+        self.assertTrue(os.path.exists(generate.FINGERPRINT_FILE))
+        db = fixture_database()
+        for language, neo in generate.ALL_DECKS:
+            options = deck_options(language, neo=neo)
+            filename = generate.get_output_file(options, generate.get_languages_to_generate(options))
+            with open(filename, 'r', encoding="utf-8") as f:
+                self.assertEqual(f.read(), "".join(generate_deck(db, options)))
+        self.run_main("all", "--check")
+
+    def test_batch_only_rebuilds_decks_whose_languages_changed(self):
+        self.run_main("all")
+        output = self.run_main("all")
+        self.assertEqual(output.count("Skipping"), len(generate.ALL_DECKS))
+
+        input_file = os.path.join(self.temp_dir.name, "eldamo-data.xml")
+        with open(FIXTURE_FILE, 'r', encoding="utf-8") as f:
+            content = f.read()
+        with open(input_file, 'w', encoding="utf-8") as f:
+            f.write(content.replace('<word l="s" v="galadh" speech="n" gloss="tree"', '<word l="s" v="galadh" speech="n" gloss="tree, wood"'))
+        with open(os.path.join(self.temp_dir.name, "Telerin.txt"), 'a', encoding="utf-8") as f:
+            f.write("edited|by hand\n")
+        with mock.patch.object(generate, "INPUT_FILE", input_file):
+            output = self.run_main("all")
+        self.assertEqual(output.count("Skipping"), len(generate.ALL_DECKS) - 3)
+        self.assertIn("galadh|tree; wood (n)\n", self.read_output("Sindarin"))
+        self.assertIn("galadh|tree; wood (n)\n", self.read_output("Neo-Sindarin"))
+        self.assertNotIn("edited", self.read_output("Telerin"))
+
+    def test_batch_from_a_database_rebuilds_every_deck_when_the_database_code_changes(self):
+        from eldamo_sqlite import import_eldamo_data
+        database_file = os.path.join(self.temp_dir.name, "eldamo.sqlite")
+        import_eldamo_data(ET.parse(FIXTURE_FILE).getroot(), database_file)
+        self.run_main("all", "--input-database", database_file)
+        output = self.run_main("all", "--input-database", database_file)
+        self.assertEqual(output.count("Skipping"), len(generate.ALL_DECKS))
+
+        original_file_hash = generate.file_hash
+        with mock.patch.object(generate, "file_hash", side_effect=lambda filename: "changed" if filename.endswith("eldamo_sqlite.py") else original_file_hash(filename)):
+            output = self.run_main("all", "--input-database", database_file)
+        self.assertNotIn("Skipping", output)
+
+    def test_card_history_is_only_recorded_when_writing_decks(self):
+        history_file = os.path.join(self.temp_dir.name, "history.sqlite")
+        generate_deck(fixture_database(), deck_options("sindarin", card_history=history_file))
+        self.assertFalse(os.path.exists(history_file))
+        self.assertIn("Recorded the cards of  Sindarin", self.run_main("sindarin", "--card-history", history_file))
+        self.assertTrue(os.path.exists(history_file))
+
+    def test_batch_with_side_effects_rebuilds_every_deck(self):
+        self.run_main("all")
+        output = self.run_main("all", "--gzip")
+        self.assertNotIn("Skipping", output)
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir.name, "Telerin.txt.gz")))
+
+class TestCheckMode(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        db = EldamoDatabase.from_root(list_to_xml([
+            {"l": "q", "v": "alda", "speech": "n", "gloss": "tree"},
+            {"l": "q", "v": "lassë", "speech": "n", "gloss": "leaf"},
+            {"l": "s", "v": "galadh", "speech": "n", "gloss": "tree"},
+        ]).getroot())
+        self.patches = [
+            mock.patch.object(generate, "OUTPUT_DIR", self.temp_dir.name),
+            mock.patch.object(generate, "FINGERPRINT_FILE", os.path.join(self.temp_dir.name, "input", "fingerprints.json")),
+            mock.patch.object(generate, "load_database", return_value=db),
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.filename = os.path.join(self.temp_dir.name, "Quenya.txt")
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.temp_dir.cleanup()
+
+    def run_main(self, *argv):
+        with mock.patch.object(sys, "argv", ["generate.py", *argv]):
+            args = parse_args()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main(args)
+        return output.getvalue()
+
+    def test_check_reports_drift_without_writing(self):
+        with open(self.filename, 'w', encoding="utf-8") as f:
+            f.write("alda|tree (n)\nnén|water (n)\n")
+        with self.assertRaises(SystemExit) as context:
+            self.run_main("quenya", "--check")
+        self.assertEqual(context.exception.code, 1)
+        with open(self.filename, 'r', encoding="utf-8") as f:
+            self.assertEqual(f.read(), "alda|tree (n)\nnén|water (n)\n")
+
+    def test_check_passes_for_up_to_date_output(self):
+        self.run_main("quenya")
+        output = self.run_main("quenya", "--check", "--verbose")
+        self.assertIn("is up to date", output)
+
+    def test_check_summarises_added_and_removed_cards(self):
+        with open(self.filename, 'w', encoding="utf-8") as f:
+            f.write("alda|tree (n)\nnén|water (n)\n")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            is_up_to_date = generate.check_output(SimpleNamespace(neo=False, verbose=True), [{"id": "q", "name": "Quenya"}], ["alda|tree (n)\n", "lassë|leaf (n)\n"])
+        self.assertFalse(is_up_to_date)
+        self.assertIn("1 cards added, 1 cards removed", output.getvalue())
+        self.assertIn("- nén|water (n)", output.getvalue())
+        self.assertIn("+ lassë|leaf (n)", output.getvalue())
+
+    def test_batch_generates_all_decks_from_one_load(self):
+        self.run_main("all")
+        self.assertEqual(generate.load_database.call_count, 1)
+        self.assertEqual(len([filename for filename in os.listdir(self.temp_dir.name) if filename.endswith(".txt")]), len(generate.ALL_DECKS))
+        self.assertTrue(os.path.exists(generate.FINGERPRINT_FILE))
+        with open(self.filename, 'r', encoding="utf-8") as f:
+            self.assertEqual(f.read(), "alda|tree (n)\nlassë|leaf (n)\n")
+        self.assertIn("is up to date", self.run_main("all", "--check"))
+
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.temp_dir.name, "eldamo-data.xml")
+        self.write_input([
+            {"l": "q", "v": "alda", "speech": "n", "gloss": "tree", "cat": "PW_VA"},
+            {"l": "q", "v": "aldë", "speech": "n", "see": {"l": "q", "v": "alda"}},
+            {"l": "q", "v": "lassë", "speech": "n", "gloss": "leaf"},
+        ])
+        self.patch = mock.patch.object(generate, "CHECKPOINT_DIR", os.path.join(self.temp_dir.name, "checkpoints"))
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.temp_dir.cleanup()
+
+    def write_input(self, words):
+        root = ET.Element("eldamo")
+        ET.SubElement(root, "cat-group", {"id": "PW", "label": "Physical World"})
+        for word in words:
+            root.append(dict_to_xml("word", word))
+        ET.ElementTree(root).write(self.input_file, encoding="utf-8")
+
+    def options(self, from_stage=None, **flags):
+        options = deck_options("quenya", **flags)
+        options.from_stage = from_stage
+        return options
+
+    def load(self):
+        return EldamoDatabase.from_file(self.input_file)
+
+    def test_checkpoints_reproduce_the_full_run(self):
+        expected = generate_cards_with_checkpoints(self.options(), self.input_file, self.load)
+        self.assertEqual(expected, ["alda; aldë|tree (n)\n", "lassë|leaf (n)\n"])
+        for stage in ["map", "dedup", "format"]:
+            resumed = generate_cards_with_checkpoints(self.options(stage), self.input_file, mock.Mock(side_effect=AssertionError("Input was loaded")))
+            self.assertEqual(resumed, expected)
+
+    def test_resuming_only_runs_the_remaining_stages(self):
+        generate_cards_with_checkpoints(self.options(), self.input_file, self.load)
+        with mock.patch.object(generate, "remove_duplications", side_effect=AssertionError("Deduplicated again")):
+            generate_cards_with_checkpoints(self.options("format"), self.input_file, self.load)
+        with mock.patch.object(generate, "words_to_maps", side_effect=AssertionError("Mapped again")):
+            generate_cards_with_checkpoints(self.options("dedup"), self.input_file, self.load)
+
+    def test_checkpoints_depend_on_input_and_options(self):
+        generate_cards_with_checkpoints(self.options(), self.input_file, self.load)
+        load = mock.Mock(side_effect=self.load)
+        generate_cards_with_checkpoints(self.options("format", include_archaic=True), self.input_file, load)
+        self.assertEqual(load.call_count, 1)
+
+        self.write_input([{"l": "q", "v": "lassë", "speech": "n", "gloss": "leaf"}])
+        resumed = generate_cards_with_checkpoints(self.options("format"), self.input_file, load)
+        self.assertEqual(load.call_count, 2)
+        self.assertEqual(resumed, ["lassë|leaf (n)\n"])
+
+    def test_checkpoints_depend_on_the_code(self):
+        generate_cards_with_checkpoints(self.options(), self.input_file, self.load)
+        load = mock.Mock(side_effect=self.load)
+        original_file_hash = generate.file_hash
+        with mock.patch.object(generate, "file_hash", side_effect=lambda filename: "changed" if filename.endswith("generate.py") else original_file_hash(filename)):
+            generate_cards_with_checkpoints(self.options("format"), self.input_file, load)
+        self.assertEqual(load.call_count, 1)
+
+    def test_only_the_latest_checkpoint_of_a_stage_is_kept(self):
+        generate_cards_with_checkpoints(self.options(), self.input_file, self.load)
+        generate_cards_with_checkpoints(self.options(include_archaic=True), self.input_file, self.load)
+        self.assertEqual(sorted(filename.split("-")[1] for filename in os.listdir(generate.CHECKPOINT_DIR)), ["dedup", "filter", "map"])
+
+    def test_missing_later_checkpoints_fall_back_to_earlier_ones(self):
+        generate_cards_with_checkpoints(self.options(), self.input_file, self.load)
+        for filename in os.listdir(generate.CHECKPOINT_DIR):
+            if "-dedup-" in filename:
+                os.remove(os.path.join(generate.CHECKPOINT_DIR, filename))
+        with mock.patch.object(generate, "words_to_maps", side_effect=AssertionError("Mapped again")):
+            resumed = generate_cards_with_checkpoints(self.options("format"), self.input_file, self.load)
+        self.assertEqual(len(resumed), 2)
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def deck_metrics(self):
+        root = list_to_xml([
+            {"l": "q", "v": "alda", "speech": "n", "gloss": "tree"},
+            {"l": "q", "v": "aldë", "speech": "n", "gloss": "tree"},
+            {"l": "q", "v": "yára", "speech": "adj", "gloss": "ancient", "mark": "†"},
+            {"l": "q", "v": "-ië", "speech": "grammar", "gloss": "infinitive"},
+            {"l": "q", "v": "nosta", "speech": "n"},
+        ])
+        db = EldamoDatabase.from_root(root)
+        metrics = new_metrics()
+        cards = generate_deck(db, deck_options("quenya"), metrics)
+        metrics["cards"] = len(cards)
+        return metrics
+
+    def test_generation_metrics_are_counted(self):
+        metrics = self.deck_metrics()
+        self.assertEqual(metrics["cards"], 1)
+        self.assertEqual(metrics["filtered_out"], {"deprecated": 0, "archaic": 1, "speech": 1, "missing_value": 0, "missing_translation": 1})
+        self.assertEqual(metrics["duplicates_merged"], 1)
+        self.assertEqual(metrics["cache"], {"base_maps": {"hits": 0, "misses": 3}})
+        self.assertEqual(sorted(metrics["stage_seconds"]), ["dedup", "filter", "format", "map"])
+
+    def test_json_metrics_keep_other_decks(self):
+        args = SimpleNamespace(metrics_file=os.path.join(self.temp_dir.name, "metrics", "generation.json"), metrics_format="json")
+        write_metrics(args, "Sindarin", self.deck_metrics())
+        write_metrics(args, "Quenya", self.deck_metrics())
+        write_metrics(args, "Quenya", self.deck_metrics())
+        with open(args.metrics_file, 'r', encoding="utf-8") as f:
+            all_metrics = json.load(f)
+        self.assertEqual(sorted(all_metrics), ["Quenya", "Sindarin"])
+        self.assertEqual(all_metrics["Quenya"]["cards"], 1)
+
+    def test_prometheus_metrics_replace_the_samples_of_the_deck(self):
+        metrics = self.deck_metrics()
+        metrics["timestamp"] = 0
+        content = format_prometheus_metrics("", "Quenya", metrics)
+        content = format_prometheus_metrics(content, "Sindarin", metrics)
+        metrics["cards"] = 2
+        content = format_prometheus_metrics(content, "Quenya", metrics)
+        lines = content.splitlines()
+        self.assertIn('eldamo_deck_cards{deck="Quenya"} 2', lines)
+        self.assertIn('eldamo_deck_cards{deck="Sindarin"} 1', lines)
+        self.assertNotIn('eldamo_deck_cards{deck="Quenya"} 1', lines)
+        self.assertIn('eldamo_words_filtered_out{deck="Quenya",reason="archaic"} 1', lines)
+        self.assertEqual(lines.count("# TYPE eldamo_deck_cards gauge"), 1)
+
+def is_lxml_installed():
+    try:
+        import lxml.etree
+    except ImportError:
+        return False
+    return True
+
+class TestImports(unittest.TestCase):
+    def test_heavy_dependencies_are_imported_lazily(self):
+        lazy_modules = ["requests", "concurrent.futures", "gzip", "tempfile"]
+        code = f"import sys, generate; print(','.join(module for module in {lazy_modules} if module in sys.modules))"
+        result = subprocess.run([sys.executable, "-S", "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "")
+
+class TestParserBackends(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.temp_dir.name, "eldamo-data.xml")
+        with open(self.input_file, 'w', encoding="utf-8") as f:
+            f.write(
+                '<eldamo><cats><cat-group id="PW" label="Physical World"/></cats>'
+                '<word l="q" v="alda" speech="n" gloss="tree" cat="PW_VA"><!-- comment --><ref v="alda"/>'
+                '<word l="q" v="aldë" speech="n"><see l="q" v="alda"/></word></word>'
+                '<word l="q" v="nersat" speech="n" gloss="ninth"><deprecated l="q" v="alda"/></word>'
+                '</eldamo>')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_stdlib_backend(self):
+        words, categories = read_endamo_data(self.input_file, "stdlib")
+        self.assertEqual([word.get("v") for word in words], ["alda", "aldë", "nersat"])
+        self.assertEqual(categories, [{"id": "PW", "label": "Physical World"}])
+
+    @unittest.skipUnless(is_lxml_installed(), "lxml is not installed")
+    def test_lxml_backend_matches_stdlib_backend(self):
+        stdlib = EldamoDatabase.from_file(self.input_file, "stdlib")
+        lxml = EldamoDatabase.from_file(self.input_file, "lxml")
+        self.assertEqual(lxml.categories, stdlib.categories)
+        self.assertEqual([dict(word.attrib) for word in lxml.words], [dict(word.attrib) for word in stdlib.words])
+        for options in [deck_options("quenya"), deck_options("quenya", neo=True)]:
+            self.assertEqual(generate_deck(lxml, options), generate_deck(stdlib, options))
+
+    def test_parallel_backend_matches_stdlib_backend(self):
+        with open(self.input_file, 'w', encoding="utf-8") as f:
+            f.write(
+                '<eldamo><cats><cat-group id="PW" label="Physical World"/></cats>'
+                '<!-- <word l="q" v="commented"> -->'
+                '<language id="q"><word l="q" v="alda" speech="n" gloss="tree &gt; bush" cat="PW_VA">'
+                '<word l="q" v="aldë" speech="n"><see l="q" v="alda"/><word l="q" v="aldëa" gloss="a > b"/></word></word></language>'
+                '<word l="q" v="nersat" speech="n" gloss="ninth"><deprecated l="q" v="alda"/><cat-group id="AN" label="Animals"/></word>'
+                '<word l="q" v="ni" gloss="I"/>'
+                '<cats><cat-group id="FA" label="Family"/></cats>'
+                '<word l="q" v="lassë" speech="n"><see l="q" v="aldëa"/></word>'
+                '</eldamo>')
+        stdlib_words, stdlib_categories = read_endamo_data(self.input_file, "stdlib")
+        for workers in [1, 2]:
+            words, categories = parse_in_parallel(self.input_file, workers)
+            self.assertEqual(categories, stdlib_categories)
+            self.assertEqual([word_to_record(word) for word in words], [word_to_record(word) for word in stdlib_words])
+
+    def test_auto_backend_falls_back_to_stdlib(self):
+        with mock.patch.dict("sys.modules", {"lxml": None, "lxml.etree": None}):
+            self.assertEqual(get_parser_backend("auto"), "stdlib")
+            with self.assertRaises(ValueError):
+                get_parser_backend("lxml")
+        with self.assertRaises(ValueError):
+            get_parser_backend("expat")
+
+class TestStreamingDownload(unittest.TestCase):
+    def setUp(self):
+        SlowEldamoHandler.content = synthetic_eldamo_data(500)
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SlowEldamoHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+        self.server_thread.start()
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def test_streamed_download_is_parsed_and_cached(self):
+        url = f"http://127.0.0.1:{self.server.server_port}/eldamo-data.xml"
+        input_file = os.path.join(self.temp_dir.name, "input", "eldamo-data.xml")
+        with mock.patch.object(generate, "INPUT_URL", url), mock.patch.object(generate, "INPUT_FILE", input_file):
+            root = stream_endamo_data()
+
+        self.assertEqual(root.tag, "eldamo")
+        self.assertEqual(len(root.findall(".//word")), 500)
+        self.assertEqual(root.find(".//cat-group").get("label"), "Animals")
+        with open(input_file, 'rb') as file:
+            self.assertEqual(file.read(), SlowEldamoHandler.content)
+        self.assertFalse(os.path.exists(input_file + ".part"))
+
+    @unittest.skipUnless(is_lxml_installed(), "lxml is not installed")
+    def test_streamed_download_uses_the_chosen_parser(self):
+        import lxml.etree
+        url = f"http://127.0.0.1:{self.server.server_port}/eldamo-data.xml"
+        input_file = os.path.join(self.temp_dir.name, "input", "eldamo-data.xml")
+        args = SimpleNamespace(check_for_updates=True, stream_download=True, parser="lxml")
+        with mock.patch.object(generate, "INPUT_URL", url), mock.patch.object(generate, "INPUT_FILE", input_file):
+            words, categories = generate.load_endamo_data(args)
+            self.assertIsInstance(words[0], lxml.etree._Element)
+            stdlib_words, stdlib_categories = generate.load_endamo_data(SimpleNamespace(check_for_updates=True, stream_download=True, parser="stdlib"))
+
+        self.assertIsInstance(stdlib_words[0], ET.Element)
+        self.assertEqual(categories, stdlib_categories)
+        self.assertEqual([dict(word.attrib) for word in words], [dict(word.attrib) for word in stdlib_words])
+
+    def test_parallel_runs_download_only_once(self):
+        SlowEldamoHandler.requests_served = 0
+        url = f"http://127.0.0.1:{self.server.server_port}/eldamo-data.xml"
+        input_file = os.path.join(self.temp_dir.name, "input", "eldamo-data.xml")
+        args = SimpleNamespace(check_for_updates=False, stream_download=False, parser="stdlib")
+        with mock.patch.object(generate, "INPUT_URL", url), mock.patch.object(generate, "INPUT_FILE", input_file):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(lambda _: generate.load_endamo_data(args), range(4)))
+
+        self.assertEqual(SlowEldamoHandler.requests_served, 1)
+        self.assertEqual([len(words) for words, _ in results], [500] * 4)
+        with open(input_file, 'rb') as file:
+            self.assertEqual(file.read(), SlowEldamoHandler.content)
+        self.assertEqual(sorted(os.listdir(os.path.dirname(input_file))), ["eldamo-data.xml", "eldamo-data.xml.lock"])
+
+    def test_failed_streamed_download_leaves_no_cache(self):
+        SlowEldamoHandler.content = b"<eldamo><word v='broken'"
+        url = f"http://127.0.0.1:{self.server.server_port}/eldamo-data.xml"
+        input_file = os.path.join(self.temp_dir.name, "input", "eldamo-data.xml")
+        with mock.patch.object(generate, "INPUT_URL", url), mock.patch.object(generate, "INPUT_FILE", input_file):
+            with self.assertRaises(ET.ParseError):
+                stream_endamo_data("stdlib")
+
+        self.assertFalse(os.path.exists(input_file))
+        self.assertFalse(os.path.exists(input_file + ".part"))
+
 if __name__ == '__main__':
     unittest.main()
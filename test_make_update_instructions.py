@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from make_update_instructions import diff_cards, format_instructions, main
+
+OLD_CARDS = [
+    ("alda", "tree (n)"),
+    ("lassë", "leaf (n)"),
+    ("cirya", "ship (n)"),
+    ("nén", "water (n)"),
+    ("ondo", "stone (n)"),
+]
+NEW_CARDS = [
+    ("alda", "tree (n)"),
+    ("lassë", "leaf; foliage (n)"),
+    ("cirya (Ships)", "ship (n)"),
+    ("ondo", "rock (n)"),
+    ("vanya", "fair (adj)"),
+]
+
+class TestMakeUpdateInstructions(unittest.TestCase):
+    def test_diff_classifies_changes(self):
+        diff = diff_cards(OLD_CARDS, NEW_CARDS)
+        self.assertEqual(diff["added"], [("vanya", "fair (adj)")])
+        self.assertEqual(diff["removed"], [("nén", "water (n)")])
+        self.assertEqual(diff["front_changed"], [(("cirya", "ship (n)"), ("cirya (Ships)", "ship (n)"))])
+        self.assertEqual(diff["back_changed"], [
+            (("lassë", "leaf (n)"), ("lassë", "leaf; foliage (n)")),
+            (("ondo", "stone (n)"), ("ondo", "rock (n)")),
+        ])
+
+    def test_identical_decks_have_no_changes(self):
+        diff = diff_cards(OLD_CARDS, list(reversed(OLD_CARDS)))
+        for changes in diff.values():
+            self.assertEqual(changes, [])
+
+    def test_instructions_use_the_existing_format(self):
+        instructions = format_instructions([("nén", "water (n)"), ("ondo", "stone (n)")], {("nén", "water (n)"): "k5p}?8Y>gk"})
+        self.assertEqual(instructions, "The following outdated cards need to be deleted manually:\nk5p}?8Y>gk | nén | water (n)\n? | ondo | stone (n)\n")
+
+    def test_instruction_file_is_written(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            old_file = os.path.join(temp_dir, "old.txt")
+            new_file = os.path.join(temp_dir, "new.txt")
+            anki_export = os.path.join(temp_dir, "export.txt")
+            with open(old_file, "w", encoding="utf-8") as f:
+                f.writelines(f"{front}|{back}\n" for front, back in OLD_CARDS)
+            with open(new_file, "w", encoding="utf-8") as f:
+                f.writelines(f"{front}|{back}\n" for front, back in NEW_CARDS)
+            with open(anki_export, "w", encoding="utf-8") as f:
+                f.write("#separator:tab\n")
+                f.writelines(f"guid{i}\t{front}\t{back}\t\n" for i, (front, back) in enumerate(OLD_CARDS))
+            os.makedirs(os.path.join(temp_dir, "update_instructions"))
+
+            cwd = os.getcwd()
+            os.chdir(temp_dir)
+            try:
+                main(SimpleNamespace(deck="Neo-Quenya", old=old_file, new=new_file, anki_export=anki_export, date="26-10-18"))
+            finally:
+                os.chdir(cwd)
+
+            with open(os.path.join(temp_dir, "update_instructions", "Neo-Quenya-26-10-18.txt"), encoding="utf-8") as f:
+                self.assertEqual(f.read(), "The following outdated cards need to be deleted manually:\nguid3 | nén | water (n)\n")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+from generate import EldamoDatabase
+from search_index import build_index, format_entry, get_terms, search
+
+def word(attributes, see=None):
+    element = ET.Element("word", attributes)
+    if see is not None:
+        ET.SubElement(element, "see", see)
+    return element
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.index_file = os.path.join(self.temp_dir.name, "search-index.sqlite")
+        db = EldamoDatabase([
+            word({"l": "eq", "v": "imbe", "speech": "n", "gloss": "hive"}),
+            word({"l": "nq", "v": "nieres", "speech": "n", "gloss": "*Hive"}),
+            word({"l": "q", "v": "kwende", "speech": "n", "gloss": "Elf"}),
+            word({"l": "q", "v": "Elessar", "speech": "masc-name", "gloss": "Elfstone"}),
+            word({"l": "mq", "v": "imbe²", "speech": "n", "gloss": "dell, deep vale"}),
+            word({"l": "s", "v": "lant", "speech": "n", "gloss": "in(wards) fall"}),
+            word({"l": "s", "v": "lhant", "speech": "n"}, see={"l": "s", "v": "lant"}),
+        ], [])
+        build_index(db, self.index_file)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_terms_are_folded_like_variants(self):
+        self.assertEqual(get_terms("*Hâ (i)rë"), {"há", "ire", "re"})
+
+    def test_glosses_are_found_in_every_language_and_deck(self):
+        entries = search(self.index_file, "HIVE")
+        self.assertEqual([(entry["l"], entry["form"], entry["decks"]) for entry in entries], [
+            ("eq", "imbë", ["Early-Quenya"]),
+            ("nq", "niëres", ["Neo-Quenya"]),
+        ])
+        self.assertEqual(format_entry(entries[0]), "Early-Quenya | imbë | n | hive | Early-Quenya")
+
+    def test_forms_are_found_in_their_normalised_spelling(self):
+        entries = search(self.index_file, "quendë", kinds=["form"])
+        self.assertEqual([(entry["form"], entry["decks"]) for entry in entries], [("quendë", ["Quenya", "Neo-Quenya"])])
+        self.assertEqual(search(self.index_file, "kwende", kinds=["form"]), [])
+
+    def test_all_query_words_have_to_match(self):
+        self.assertEqual([entry["form"] for entry in search(self.index_file, "deep dell")], ["imbë"])
+        self.assertEqual(search(self.index_file, "deep hive"), [])
+
+    def test_references_and_optional_parts_are_searchable(self):
+        self.assertEqual([entry["form"] for entry in search(self.index_file, "in fall")], ["lant", "lhant"])
+        self.assertEqual([entry["form"] for entry in search(self.index_file, "inwards", language="Sindarin")], ["lant", "lhant"])
+        self.assertEqual(search(self.index_file, "inwards", language="q"), [])
+
+    def test_names_are_in_no_deck(self):
+        entries = search(self.index_file, "elfstone")
+        self.assertEqual(entries[0]["decks"], [])
+        self.assertTrue(format_entry(entries[0]).endswith("| no deck"))
+
+    def test_missing_index_is_reported(self):
+        with self.assertRaises(ValueError):
+            search(os.path.join(self.temp_dir.name, "missing.sqlite"), "hive")
+
+if __name__ == '__main__':
+    unittest.main()
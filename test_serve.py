@@ -0,0 +1,140 @@
+import os
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from unittest import mock
+import xml.etree.ElementTree as ET
+import generate
+from serve import DeckService, make_handler, normalise_options, options_from_query, options_key
+
+def write_eldamo_data(filename, words):
+    root = ET.Element("eldamo")
+    for word in words:
+        ET.SubElement(root, "word", word)
+    ET.ElementTree(root).write(filename, encoding="utf-8")
+
+class TestServe(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.temp_dir.name, "eldamo-data.xml")
+        write_eldamo_data(self.input_file, [
+            {"l": "q", "v": "alda", "speech": "n", "gloss": "tree"},
+            {"l": "q", "v": "Elessar", "speech": "masc-name", "gloss": "Elfstone"},
+            {"l": "s", "v": "galadh", "speech": "n", "gloss": "tree"},
+        ])
+        self.patch = mock.patch.object(generate, "INPUT_FILE", self.input_file)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.temp_dir.cleanup()
+
+    def test_options_are_normalised(self):
+        by_name = options_from_query("language=Quenya&individual-names=1")
+        by_id = options_from_query("language=q&individual_names=true&include-origin=1")
+        self.assertEqual(by_name.language, "q")
+        self.assertTrue(by_name.individual_names)
+        self.assertFalse(by_id.include_origin)
+        self.assertEqual(options_key(by_name), options_key(by_id))
+
+    def test_invalid_options_are_rejected(self):
+        with self.assertRaises(ValueError):
+            options_from_query("neo=1")
+        with self.assertRaises(ValueError):
+            options_from_query("language=q&bogus=1")
+        with self.assertRaises(ValueError):
+            options_from_query("language=klingon")
+
+    def test_generated_decks_are_cached(self):
+        service = DeckService(cache_size=1)
+        service.load()
+        options = normalise_options("quenya", {})
+        with mock.patch.object(generate, "generate_deck", wraps=generate.generate_deck) as generate_deck:
+            self.assertEqual(service.generate(options), "alda|tree (n)\n")
+            self.assertEqual(service.generate(options), "alda|tree (n)\n")
+            self.assertEqual(generate_deck.call_count, 1)
+
+            service.generate(normalise_options("sindarin", {}))
+            service.generate(options)
+            self.assertEqual(generate_deck.call_count, 3)
+        self.assertEqual(service.hits, 1)
+        self.assertEqual(service.misses, 3)
+
+    def test_service_reloads_changed_input(self):
+        service = DeckService()
+        service.load()
+        options = normalise_options("quenya", {})
+        self.assertEqual(service.generate(options), "alda|tree (n)\n")
+
+        write_eldamo_data(self.input_file, [{"l": "q", "v": "lassë", "speech": "n", "gloss": "leaf"}])
+        os.utime(self.input_file, ns=(0, service.input_mtime + 1))
+        self.assertEqual(service.generate(options), "lassë|leaf (n)\n")
+
+    def test_previous_data_is_served_when_the_input_breaks(self):
+        service = DeckService()
+        service.load()
+        options = normalise_options("quenya", {})
+        self.assertEqual(service.generate(options), "alda|tree (n)\n")
+
+        with open(self.input_file, 'w', encoding="utf-8") as f:
+            f.write("<eldamo><word")
+        os.utime(self.input_file, ns=(0, service.input_mtime + 1))
+        with mock.patch("builtins.print"), mock.patch.object(generate.EldamoDatabase, "from_file", wraps=generate.EldamoDatabase.from_file) as from_file:
+            self.assertEqual(service.generate(options), "alda|tree (n)\n")
+            self.assertEqual(service.generate(options), "alda|tree (n)\n")
+            self.assertEqual(from_file.call_count, 1)
+
+            os.remove(self.input_file)
+            self.assertEqual(service.generate(normalise_options("sindarin", {})), "galadh|tree (n)\n")
+            self.assertEqual(from_file.call_count, 1)
+
+        write_eldamo_data(self.input_file, [{"l": "q", "v": "lassë", "speech": "n", "gloss": "leaf"}])
+        self.assertEqual(service.generate(options), "lassë|leaf (n)\n")
+
+    def test_cached_decks_are_served_during_a_reload(self):
+        service = DeckService()
+        service.load()
+        options = normalise_options("quenya", {})
+        service.generate(options)
+        os.utime(self.input_file, ns=(0, service.input_mtime + 1))
+        with service.reload_lock, mock.patch.object(generate.EldamoDatabase, "from_file", side_effect=AssertionError("Input was reloaded")):
+            self.assertEqual(service.generate(options), "alda|tree (n)\n")
+        self.assertEqual(service.hits, 1)
+
+    def test_changed_overlay_is_merged_without_reloading_the_input(self):
+        overlay = os.path.join(self.temp_dir.name, "overlay.csv")
+        with open(overlay, 'w', encoding="utf-8") as f:
+            f.write("l,v,speech,gloss\nq,lassë,n,leaf\n")
+        service = DeckService(overlays=[overlay])
+        service.load()
+        options = normalise_options("quenya", {})
+        self.assertEqual(service.generate(options), "alda|tree (n)\nlassë|leaf (n)\n")
+
+        with open(overlay, 'w', encoding="utf-8") as f:
+            f.write("l,v,gloss\nq,alda,wood\n")
+        os.utime(overlay, ns=(0, service.overlay_mtimes[0] + 1))
+        with mock.patch.object(generate.EldamoDatabase, "from_file", side_effect=AssertionError("Input was reloaded")):
+            self.assertEqual(service.generate(options), "alda|wood (n)\n")
+
+    def test_decks_are_served_over_http(self):
+        service = DeckService()
+        service.load()
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(service))
+        thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+        thread.start()
+        try:
+            url = f"http://127.0.0.1:{server.server_port}/deck?language=quenya&individual-names"
+            with urllib.request.urlopen(url) as response:
+                self.assertEqual(response.read().decode("utf-8"), "Elessar|Elfstone (masc-name)\nalda|tree (n)\n")
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/deck?language=klingon")
+            self.assertEqual(context.exception.code, 400)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+import update_update_file
+from update_update_file import find_similar_cards, main
+
+class TestUpdateUpdateFile(unittest.TestCase):
+    def test_similar_cards_are_paired(self):
+        outdated = [("g1", "alda", "tree (n)"), ("g2", "ondo", "stone (n)")]
+        new = [("vanya", "fair (adj)"), ("alda (ald-)", "tree; wood (n)")]
+        matches = find_similar_cards(outdated, new, 0.6)
+        self.assertEqual(len(matches), 1)
+        old_card, new_card, score = matches[0]
+        self.assertEqual(old_card, ("g1", "alda", "tree (n)"))
+        self.assertEqual(new_card, ("alda (ald-)", "tree; wood (n)"))
+        self.assertGreaterEqual(score, 0.6)
+
+    def test_each_card_is_paired_at_most_once(self):
+        outdated = [("g1", "hyarna", "southern (adj)"), ("g2", "hyarna", "southern; south (adj)")]
+        new = [("hyarna [þ]", "southern (adj)")]
+        matches = find_similar_cards(outdated, new, 0.6)
+        self.assertEqual(matches, [(("g1", "hyarna", "southern (adj)"), ("hyarna [þ]", "southern (adj)"), matches[0][2])])
+
+    def test_threshold_above_one_disables_pairing(self):
+        matches = find_similar_cards([("g1", "alda", "tree (n)")], [("alda (ald-)", "tree (n)")], 1.01)
+        self.assertEqual(matches, [])
+
+    def test_paired_cards_keep_their_guid(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            new_directory = os.path.join(temp_dir, "output")
+            old_directory = os.path.join(temp_dir, "anki_exports")
+            os.makedirs(new_directory)
+            os.makedirs(old_directory)
+            with open(os.path.join(new_directory, "Deck.txt"), "w") as f:
+                f.write("alda (ald-)|tree; wood (n)\nvanya|fair (adj)\n")
+            with open(os.path.join(old_directory, "Deck.txt"), "w") as f:
+                f.write("#separator:tab\ng1\talda\ttree (n)\t\ng2\tnén\twater (n)\t\n")
+
+            original_directories = (update_update_file.NEW_DATA_DIRECTORY, update_update_file.OLD_DATA_DIRECTORY)
+            update_update_file.NEW_DATA_DIRECTORY = new_directory
+            update_update_file.OLD_DATA_DIRECTORY = old_directory
+            try:
+                main(SimpleNamespace(filename="Deck.txt", similarity_threshold=0.6))
+            finally:
+                update_update_file.NEW_DATA_DIRECTORY, update_update_file.OLD_DATA_DIRECTORY = original_directories
+
+            with open(os.path.join(old_directory, "Deck.txt")) as f:
+                self.assertEqual(f.read(), "#separator:tab\ng1\talda (ald-)\ttree; wood (n)\t\n")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,109 +1,220 @@
+import argparse
 import os
 import sys
 
-filename = sys.argv[1]
-
-new_data_directory = "output/"
-new_data_file_path = os.path.join(new_data_directory, filename)
-old_data_directory = "anki_exports/"
-old_data_file_path = os.path.join(old_data_directory, filename)
-
-if not os.path.exists(new_data_directory):
-    print("Data for ", filename, " was not found.")
-    print("You need to run the generate.py script first.")
-    sys.exit(1)
-
-if not os.path.exists(old_data_file_path):
-    print("Anki Export for ", filename, " was not found.")
-    print("Go to the Anki app and klick on the gear icon  next to the deck.")
-    print("Then click on 'Export'.")
-    print("Choose the 'Notes in Plain Text' option, tick the 'Include unique identifier' checkbox.")
-    print("click 'Export' and save the file to ", old_data_file_path)
-    sys.exit(1)
-
-new_data = []
-with open(new_data_file_path, "r") as new_data_file:
-    for line in new_data_file:
-        front, back = line.strip().split("|")
-        new_data.append((front, back))
-
-preamble = []
-old_data = []
-with open(old_data_file_path, "r") as old_data_file:
-    for line in old_data_file:
-        if line.startswith("#"):
-            preamble.append(line)
-        else:
-            guid, front, back = line.strip().split("\t")
-            old_data.append((guid, front, back))
-
-deleted_cards = []
-for i, (guid, front, back) in enumerate(old_data):
-    wasFound = False
+NEW_DATA_DIRECTORY = "output/"
+OLD_DATA_DIRECTORY = "anki_exports/"
+NGRAM_SIZE = 3
+DEFAULT_SIMILARITY_THRESHOLD = 0.6
+# N-grams shared by more cards than this, like the part of speech suffix, are too common to find candidates with.
+MAX_POSTING_LENGTH = 50
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Update an Anki export to the newly generated cards, keeping the GUIDs of changed cards.')
+    parser.add_argument('filename', type=str, help='Name of the deck file, e.g. Neo-Quenya.txt')
+    parser.add_argument('--similarity-threshold', type=float, default=DEFAULT_SIMILARITY_THRESHOLD, help='Minimal similarity for pairing a changed card with an outdated one; values above 1 disable the pairing')
+
+    return parser.parse_args()
+
+def read_new_data(new_data_file_path):
+    new_data = []
+    with open(new_data_file_path, "r") as new_data_file:
+        for line in new_data_file:
+            front, back = line.strip().split("|")
+            new_data.append((front, back))
+    return new_data
+
+def read_old_data(old_data_file_path):
+    preamble = []
+    old_data = []
+    with open(old_data_file_path, "r") as old_data_file:
+        for line in old_data_file:
+            if line.startswith("#"):
+                preamble.append(line)
+            else:
+                guid, front, back = line.strip().split("\t")
+                old_data.append((guid, front, back))
+    return preamble, old_data
+
+def update_old_data(old_data, new_data):
+    deleted_cards = []
+    for i, (guid, front, back) in enumerate(old_data):
+        wasFound = False
+        for new_front, new_back in new_data:
+            isSameFront = front == new_front
+            isSameBack = back == new_back
+            if isSameFront and isSameBack:
+                wasFound = True
+                break
+            if isSameFront and not isSameBack:
+                old_data[i] = (guid, front, new_back)
+                wasFound = True
+                break
+            if not isSameFront and isSameBack:
+                old_data[i] = (guid, new_front, back)
+                wasFound = True
+                break
+        if not wasFound:
+            deleted_cards.append((guid, front, back))
+    return deleted_cards
+
+def find_duplicates(old_data):
+    duplicates = []
+    for i, (guid, front, back) in enumerate(old_data):
+        for j, (guid2, front2, back2) in enumerate(old_data):
+            if i == j:
+                continue
+            if front == front2 and back == back2:
+                duplicates.append((guid, front, back))
+                break
+    return duplicates
+
+def find_new_cards(new_data, old_data):
+    new_cards = []
     for new_front, new_back in new_data:
-        isSameFront = front == new_front
-        isSameBack = back == new_back
-        if isSameFront and isSameBack:
-            wasFound = True
-            break
-        if isSameFront and not isSameBack:
-            old_data[i] = (guid, front, new_back)
-            wasFound = True
-            break
-        if not isSameFront and isSameBack:
-            old_data[i] = (guid, new_front, back)
-            wasFound = True
-            break
-    if not wasFound:
-        deleted_cards.append((guid, front, back))
-
-if len(deleted_cards) > 0:
-    print()
-    print("The following outdated cards need to be deleted manually:")
-for guid, front, back in deleted_cards:
-    print(guid, "|", front, "|", back)
-    old_data.remove((guid, front, back))
-
-duplicates = []
-for i, (guid, front, back) in enumerate(old_data):
-    for j, (guid2, front2, back2) in enumerate(old_data):
-        if i == j:
+        is_new = True
+        for guid, front, back in old_data:
+            if front == new_front:
+                is_new = False
+                break
+        if is_new:
+            new_cards.append((new_front, new_back))
+    return new_cards
+
+def ngrams(text):
+    padded = f"  {text} "
+    return set(padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1))
+
+def similarity(grams1, grams2):
+    if not grams1 and not grams2:
+        return 1.0
+    return 2 * len(grams1 & grams2) / (len(grams1) + len(grams2))
+
+def build_ngram_index(gram_sets):
+    index = {}
+    for position, grams in enumerate(gram_sets):
+        for gram in grams:
+            index.setdefault(gram, []).append(position)
+    return index
+
+def find_similar_cards(outdated_cards, new_cards, threshold):
+    """
+    Pairs outdated cards (guid, front, back) with new cards (front, back) whose front and back are similar.
+    Candidates are found through an inverted index of character n-grams, so not every pair is compared.
+    Returns (outdated card, new card, similarity) tuples, each card being used at most once.
+    """
+    new_fronts = [ngrams(front) for front, _ in new_cards]
+    new_backs = [ngrams(back) for _, back in new_cards]
+    front_index = build_ngram_index(new_fronts)
+    back_index = build_ngram_index(new_backs)
+
+    scored_pairs = []
+    for outdated_position, (_, front, back) in enumerate(outdated_cards):
+        front_grams = ngrams(front)
+        back_grams = ngrams(back)
+        candidates = set()
+        for grams, index in [(front_grams, front_index), (back_grams, back_index)]:
+            for gram in grams:
+                postings = index.get(gram, [])
+                if len(postings) <= MAX_POSTING_LENGTH:
+                    candidates.update(postings)
+        for new_position in candidates:
+            score = (similarity(front_grams, new_fronts[new_position]) + similarity(back_grams, new_backs[new_position])) / 2
+            if score >= threshold:
+                scored_pairs.append((score, outdated_position, new_position))
+
+    scored_pairs.sort(key=lambda pair: (-pair[0], pair[1], pair[2]))
+    used_outdated = set()
+    used_new = set()
+    matches = []
+    for score, outdated_position, new_position in scored_pairs:
+        if outdated_position in used_outdated or new_position in used_new:
             continue
-        if front == front2 and back == back2:
-            duplicates.append((guid, front, back))
-            break
+        used_outdated.add(outdated_position)
+        used_new.add(new_position)
+        matches.append((outdated_cards[outdated_position], new_cards[new_position], score))
+    matches.sort(key=lambda match: match[0][1])
+    return matches
+
+def write_old_data(old_data_file_path, preamble, old_data):
+    with open(old_data_file_path, "w") as old_data_file:
+        for line in preamble:
+            old_data_file.write(line)
+
+        for guid, front, back in old_data:
+            old_data_file.write(f"{guid}\t{front}\t{back}\t\n")
+
+def main(args):
+    filename = args.filename
+    new_data_file_path = os.path.join(NEW_DATA_DIRECTORY, filename)
+    old_data_file_path = os.path.join(OLD_DATA_DIRECTORY, filename)
+
+    if not os.path.exists(NEW_DATA_DIRECTORY):
+        print("Data for ", filename, " was not found.")
+        print("You need to run the generate.py script first.")
+        sys.exit(1)
+
+    if not os.path.exists(old_data_file_path):
+        print("Anki Export for ", filename, " was not found.")
+        print("Go to the Anki app and klick on the gear icon  next to the deck.")
+        print("Then click on 'Export'.")
+        print("Choose the 'Notes in Plain Text' option, tick the 'Include unique identifier' checkbox.")
+        print("click 'Export' and save the file to ", old_data_file_path)
+        sys.exit(1)
+
+    new_data = read_new_data(new_data_file_path)
+    preamble, old_data = read_old_data(old_data_file_path)
+
+    deleted_cards = update_old_data(old_data, new_data)
+
+    deleted = set(deleted_cards)
+    remaining_cards = [card for card in old_data if card not in deleted]
+    unmatched_new_cards = find_new_cards(new_data, remaining_cards)
+    similar_cards = find_similar_cards(deleted_cards, unmatched_new_cards, args.similarity_threshold)
+
+    if len(similar_cards) > 0:
+        print()
+        print("The following cards were paired with a similar new card and updated:")
+    positions = {}
+    for position, card in enumerate(old_data):
+        positions.setdefault(card, position)
+    for (guid, front, back), (new_front, new_back), score in similar_cards:
+        print(guid, "|", front, "|", back, "->", new_front, "|", new_back, f"({score:.2f})")
+        old_data[positions[(guid, front, back)]] = (guid, new_front, new_back)
+    paired = set(card for card, _, _ in similar_cards)
+    deleted_cards = [card for card in deleted_cards if card not in paired]
+
+    if len(deleted_cards) > 0:
+        print()
+        print("The following outdated cards need to be deleted manually:")
+    for guid, front, back in deleted_cards:
+        print(guid, "|", front, "|", back)
+        old_data.remove((guid, front, back))
+
+    duplicates = find_duplicates(old_data)
+
+    if len(duplicates) > 0:
+        duplicates.sort(key=lambda x: x[1])
+        print()
+        print("The following duplicates were found:")
+    for guid, front, back in duplicates:
+        print(guid, "|", front, "|", back)
+        old_data.remove((guid, front, back))
+
+    new_cards = find_new_cards(new_data, old_data)
+
+    if len(new_cards) > 0:
+        print()
+        print("New cards were added. Please import the file into Anki **after** adjusting the currently stored cards.")
+    for front, back in new_cards:
+        print("|", front, "|", back)
+
+    write_old_data(old_data_file_path, preamble, old_data)
 
-if len(duplicates) > 0:
-    duplicates.sort(key=lambda x: x[1])
-    print()
-    print("The following duplicates were found:")
-for guid, front, back in duplicates:
-    print(guid, "|", front, "|", back)
-    old_data.remove((guid, front, back))
-
-new_cards = []
-for new_front, new_back in new_data:
-    is_new = True
-    for guid, front, back in old_data:
-        if front == new_front:
-            is_new = False
-            break
-    if is_new:
-        new_cards.append((new_front, new_back))
-
-if len(new_cards) > 0:
     print()
-    print("New cards were added. Please import the file into Anki **after** adjusting the currently stored cards.")
-for front, back in new_cards:
-    print("|", front, "|", back)
-
-with open(old_data_file_path, "w") as old_data_file:
-    for line in preamble:
-        old_data_file.write(line)
-    
-    for guid, front, back in old_data:
-        old_data_file.write(f"{guid}\t{front}\t{back}\t\n")
-
-print()
-print("Finished updating.")
-print("When importing the file, make very sure to update front and back, not front and tags!")
+    print("Finished updating.")
+    print("When importing the file, make very sure to update front and back, not front and tags!")
+
+if __name__ == "__main__":
+    args = parse_args()
+    main(args)